@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import aiomysql
+from common.log import logUtils as log
+from objects import glob
+
+
+class db:
+    """
+    An asyncio MySQL helper backed by an aiomysql connections pool
+    """
+
+    __slots__ = ("config", "minSize", "maxSize", "pool")
+
+    def __init__(self, host, username, password, database, maxSize=128, minSize=1):
+        """
+        Initialize a new asyncio MySQL database helper.
+        The pool is not created until `connect` is awaited.
+
+        :param host: MySQL host
+        :param username: MySQL username
+        :param password: MySQL password
+        :param database: MySQL database name
+        :param maxSize: pool max size
+        :param minSize: number of connections opened when the pool is created
+        """
+        self.config = (host, username, password, database)
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.pool = None
+
+    async def connect(self):
+        """
+        Create the connections pool.
+        Must be awaited on the event loop that will run the queries.
+
+        :return:
+        """
+        host, username, password, database = self.config
+        self.pool = await aiomysql.create_pool(
+            host=host,
+            user=username,
+            password=password,
+            db=database,
+            minsize=self.minSize,
+            maxsize=self.maxSize,
+            autocommit=True,
+            charset="utf8",
+            use_unicode=True,
+        )
+        log.debug(f"Created async MySQL pool. Max size: {self.maxSize}")
+
+    async def close(self):
+        """
+        Close every connection in the pool and wait for them to be released
+
+        :return:
+        """
+        if self.pool is None:
+            return
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.pool = None
+
+    async def execute(self, query, params=None):
+        """
+        Executes a query
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        :return: last inserted row id
+        """
+        if params is None:
+            params = ()
+        glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_async_pool.queries")
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, params)
+                log.debug(query)
+                return cursor.lastrowid
+
+    async def fetch(self, query, params=None, _all=False):
+        """
+        Fetch a single value from db that matches given query
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        :param _all: fetch one or all values. Used internally. Use fetchAll if you want to fetch all values
+        """
+        if params is None:
+            params = ()
+        glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_async_pool.queries")
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, params)
+                log.debug(query)
+                if _all:
+                    return await cursor.fetchall()
+                else:
+                    return await cursor.fetchone()
+
+    async def fetchAll(self, query, params=None):
+        """
+        Fetch all values from db that match given query.
+        Calls self.fetch with all = True.
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        """
+        if params is None:
+            params = ()
+        return await self.fetch(query, params, _all=True)
@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+import atexit
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from common.log import logUtils as log
+from objects import glob
+
+
+class counterBuffer:
+    """
+    Write-behind buffer for hot counter updates.
+    Increments (and last-value-wins assignments) are accumulated in memory per row
+    and flushed periodically, with one batched statement per table and set of columns,
+    so the number of statements and row locks depends on the number of distinct rows
+    rather than on the number of events.
+    Without a flush interval, every update is written right away with its own statement.
+    """
+
+    __slots__ = (
+        "db",
+        "flushInterval",
+        "maxEntries",
+        "maxAttempts",
+        "entries",
+        "attempts",
+        "lock",
+        "flushLock",
+        "wake",
+        "thread",
+    )
+
+    def __init__(self, db, flushInterval=None, maxEntries=1000, maxAttempts=5):
+        """
+        Initialize a counter buffer
+
+        :param db: dbConnector.db object used to flush the buffer
+        :param flushInterval: seconds between flushes. If None, every update is written right away
+        :param maxEntries: flush as soon as this many rows are buffered
+        :param maxAttempts: a row that can't be written this many flushes in a row is dropped
+        """
+        self.db = db
+        self.flushInterval = flushInterval
+        self.maxEntries = maxEntries
+        self.maxAttempts = maxAttempts
+        # (table, upsert, key columns, key values) -> {column: [isDelta, value]}
+        self.entries = {}
+        # (table, upsert, key columns, key values) -> number of failed flushes
+        self.attempts = {}
+        self.lock = Lock()
+        self.flushLock = Lock()
+        self.wake = Event()
+        self.thread = None
+        if flushInterval is not None:
+            self.thread = Thread(target=self.flushLoop, daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def add(self, table, key, column, value, isDelta, upsert=False):
+        """
+        Buffer an update
+
+        :param table: table name
+        :param key: row key. A {column: value} dictionary, or a tuple with the
+                    values of the first columns of the table (upsert only)
+        :param column: updated column
+        :param value: delta or new value
+        :param isDelta: if True, `value` is added to the column, otherwise it replaces it
+        :param upsert: if True, insert the row if it doesn't exist
+        :return:
+        """
+        self.addMany(table, key, {column: (isDelta, value)}, upsert)
+
+    def addMany(self, table, key, updates, upsert=False):
+        """
+        Buffer some updates of the same row, that are written with a single statement.
+        Without a flush interval, errors are raised to the caller.
+
+        :param table: table name
+        :param key: row key. See add.
+        :param updates: {column: (isDelta, value)} dictionary. See add.
+        :param upsert: if True, insert the row if it doesn't exist
+        :return:
+        """
+        if isinstance(key, dict):
+            keyColumns = tuple(key)
+            keyValues = tuple(key.values())
+        else:
+            keyColumns = None
+            keyValues = tuple(key)
+
+        if self.thread is None:
+            # Write-through, nothing is shared with the other threads
+            query, paramsList = self.buildBatch(
+                table,
+                upsert,
+                keyColumns,
+                tuple((column, v[0]) for column, v in updates.items()),
+                [(keyValues, tuple(v[1] for v in updates.values()))],
+            )
+            self.db.execute(query, paramsList[0])
+            return
+
+        entryKey = (table, upsert, keyColumns, keyValues)
+        with self.lock:
+            columns = self.entries.get(entryKey)
+            if columns is None:
+                columns = self.entries[entryKey] = {}
+            for column, (isDelta, value) in updates.items():
+                current = columns.get(column)
+                if current is not None and isDelta:
+                    # A delta on top of a buffered value (or delta) just adds up
+                    current[1] += value
+                else:
+                    columns[column] = [isDelta, value]
+            size = len(self.entries)
+
+        if size >= self.maxEntries:
+            self.wake.set()
+
+    def increment(self, table, key, column, delta=1, upsert=False):
+        """
+        Buffer `column = column + delta`.
+        See add.
+        """
+        self.add(table, key, column, delta, True, upsert)
+
+    def incrementMany(self, table, key, deltas, upsert=False):
+        """
+        Buffer `column = column + delta` for some columns of the same row.
+        See addMany.
+
+        :param deltas: {column: delta} dictionary
+        """
+        self.addMany(
+            table,
+            key,
+            {column: (True, delta) for column, delta in deltas.items()},
+            upsert,
+        )
+
+    def set(self, table, key, column, value, upsert=False):
+        """
+        Buffer `column = value`. Only the last value is written.
+        See add.
+        """
+        self.add(table, key, column, value, False, upsert)
+
+    def pending(self, table, key, column):
+        """
+        Return the buffered delta of a column, that is not in the db yet
+
+        :param table: table name
+        :param key: row key. See add.
+        :param column: column name
+        :return: buffered delta, 0 if there's nothing buffered
+        """
+        if isinstance(key, dict):
+            entryKey = (table, False, tuple(key), tuple(key.values()))
+        else:
+            entryKey = (table, False, None, tuple(key))
+        with self.lock:
+            columns = self.entries.get(entryKey)
+            if columns is None or column not in columns:
+                return 0
+            isDelta, value = columns[column]
+            return value if isDelta else 0
+
+    def withPending(self, table, key, column, read):
+        """
+        Read a column from the db and add its buffered delta,
+        without a flush in between that would count the delta twice or not at all
+
+        :param table: table name
+        :param key: row key. See add.
+        :param column: column name
+        :param read: function that reads the column value from the db.
+                    If it returns None, None is returned.
+        :return: db value plus buffered delta, or None
+        """
+        if self.thread is None:
+            return read()
+        with self.flushLock:
+            value = read()
+            if value is None:
+                return None
+            return value + self.pending(table, key, column)
+
+    def flushLoop(self):
+        """
+        Flush the buffer every self.flushInterval seconds, or when it's full
+
+        :return:
+        """
+        while True:
+            self.wake.wait(self.flushInterval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f"Error while flushing counters: {e}")
+
+    def requeue(self, entries):
+        """
+        Put back in the buffer some updates that couldn't be written,
+        under the ones that have been buffered in the meantime.
+        Rows that have failed self.maxAttempts times are dropped.
+
+        :param entries: flushed entries, like self.entries
+        :return: number of dropped rows
+        """
+        dropped = 0
+        with self.lock:
+            for entryKey, columns in entries.items():
+                attempts = self.attempts.get(entryKey, 0) + 1
+                if attempts >= self.maxAttempts:
+                    log.error(
+                        f"Dropping {entryKey[0]} counters {entryKey[3]} {columns}, "
+                        f"couldn't flush them {attempts} times",
+                    )
+                    self.attempts.pop(entryKey, None)
+                    dropped += 1
+                    continue
+                self.attempts[entryKey] = attempts
+                newer = self.entries.get(entryKey)
+                if newer is None:
+                    self.entries[entryKey] = columns
+                    continue
+                for column, (isDelta, value) in columns.items():
+                    current = newer.get(column)
+                    if current is None:
+                        newer[column] = [isDelta, value]
+                    elif current[0]:
+                        # The newer deltas go on top of the older delta or value
+                        newer[column] = [isDelta, value + current[1]]
+                    # else: the newer value wins
+        return dropped
+
+    def write(self, query, paramsList):
+        """
+        Write a batch of rows atomically
+
+        :param query: statement built by buildBatch
+        :param paramsList: parameters sets built by buildBatch
+        :return:
+        """
+        if len(paramsList) == 1:
+            self.db.execute(query, paramsList[0])
+            return
+        with self.db.transaction() as tx:
+            tx.executeMany(query, paramsList)
+
+    def flush(self):
+        """
+        Write all the buffered updates.
+        Rows that can't be written are put back in the buffer.
+
+        :return: number of flushed rows
+        """
+        with self.flushLock:
+            with self.lock:
+                entries = self.entries
+                self.entries = {}
+            if not entries:
+                return 0
+
+            # Group the rows that can share the same statement
+            batches = {}
+            for entryKey, columns in entries.items():
+                table, upsert, keyColumns, _ = entryKey
+                updates = tuple((column, v[0]) for column, v in columns.items())
+                batches.setdefault((table, upsert, keyColumns, updates), []).append(
+                    entryKey,
+                )
+
+            failed = {}
+            for (table, upsert, keyColumns, updates), entryKeys in batches.items():
+                rows = [
+                    (entryKey[3], tuple(v[1] for v in entries[entryKey].values()))
+                    for entryKey in entryKeys
+                ]
+                query, paramsList = self.buildBatch(
+                    table,
+                    upsert,
+                    keyColumns,
+                    updates,
+                    rows,
+                )
+                try:
+                    # All or none of the rows are written
+                    self.write(query, paramsList)
+                    written = entryKeys
+                except self.db.pool.backend.Error as e:
+                    # A row may be invalid, write them one by one
+                    # so only the failing ones are kept
+                    log.error(f"Couldn't flush {len(rows)} {table} counters: {e}")
+                    written = []
+                    if len(rows) > 1:
+                        for entryKey, params in zip(entryKeys, paramsList):
+                            try:
+                                self.db.execute(query, params)
+                                written.append(entryKey)
+                            except Exception:
+                                failed[entryKey] = entries[entryKey]
+                    else:
+                        failed[entryKeys[0]] = entries[entryKeys[0]]
+                except Exception as e:
+                    # Nothing has been written (pool exhausted, timeout...)
+                    log.error(f"Couldn't flush {len(rows)} {table} counters: {e}")
+                    written = []
+                    for entryKey in entryKeys:
+                        failed[entryKey] = entries[entryKey]
+
+                if len(written) != len(entryKeys):
+                    glob.dog.increment(
+                        f"{glob.DATADOG_PREFIX}.mysql_counters.failed",
+                        len(entryKeys) - len(written),
+                    )
+                if self.attempts:
+                    with self.lock:
+                        for entryKey in written:
+                            self.attempts.pop(entryKey, None)
+
+            if failed:
+                # They'll be tried again with the next flush
+                dropped = self.requeue(failed)
+                if dropped:
+                    glob.dog.increment(
+                        f"{glob.DATADOG_PREFIX}.mysql_counters.dropped",
+                        dropped,
+                    )
+            glob.dog.increment(
+                f"{glob.DATADOG_PREFIX}.mysql_counters.flushed",
+                len(entries) - len(failed),
+            )
+            return len(entries) - len(failed)
+
+    @staticmethod
+    def buildBatch(table, upsert, keyColumns, updates, rows):
+        """
+        Build the statement and the parameters sets for a batch of rows
+
+        :param table: table name
+        :param upsert: if True, build an INSERT ... ON DUPLICATE KEY UPDATE
+        :param keyColumns: key column names, or None for a positional insert
+        :param updates: tuple of (column, isDelta) tuples
+        :param rows: list of (key values, column values) tuples
+        :return: (query, parameters list) tuple
+        """
+        if upsert:
+            # Multi-row upsert, rewritten by the driver into a single statement
+            placeholders = ", ".join(["%s"] * (len(rows[0][0]) + len(updates)))
+            columns = (
+                f"({', '.join(keyColumns + tuple(c for c, _ in updates))}) "
+                if keyColumns is not None
+                else ""
+            )
+            assignments = ", ".join(
+                f"{c} = {c} + VALUES({c})" if isDelta else f"{c} = VALUES({c})"
+                for c, isDelta in updates
+            )
+            query = (
+                f"INSERT INTO {table} {columns}VALUES ({placeholders}) "
+                f"ON DUPLICATE KEY UPDATE {assignments}"
+            )
+            return query, [keyValues + values for keyValues, values in rows]
+
+        assignments = ", ".join(
+            f"{c} = {c} + %s" if isDelta else f"{c} = %s" for c, isDelta in updates
+        )
+        conditions = " AND ".join(f"{c} = %s" for c in keyColumns)
+        query = f"UPDATE {table} SET {assignments} WHERE {conditions} LIMIT 1"
+        return query, [values + keyValues for keyValues, values in rows]
@@ -1,21 +1,187 @@
 from __future__ import annotations
 
-import inspect
+import os
+import random
+import re
 import time
-from queue import Queue
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from queue import Empty
+from queue import Full
+from queue import LifoQueue
+from threading import Event
+from threading import get_ident
+from threading import local
+from threading import Lock
+from threading import Thread
+from threading import Timer
 
-import MySQLdb.cursors
 import settings
+from common.db import queryStats
+from common.db.counterBuffer import counterBuffer
+from common.db.queryCache import MISS
+from common.db.queryCache import queryCache
+from common.db.queryTracer import queryTracer
 from common.log import logUtils as log
 from objects import glob
 
+# Row types for fetch, fetchAll and fetchIter
+ROW_DICT = 0  # a dictionary for each row (default)
+ROW_TUPLE = 1  # a plain tuple for each row
+ROW_SCALAR = 2  # only the first column of each row
+ROW_RECORD = 3  # a per-query record object, supporting both row.name and row["name"]
+
+# Seconds between two idle workers reaps
+REAP_INTERVAL = 5
+
+# Files skipped by the query tracer, so the queries run by these helpers
+# are attributed to their callers
+TRACER_SKIP_FILES = (
+    __file__,
+    queryStats.__file__,
+    os.path.join(os.path.dirname(__file__), "counterBuffer.py"),
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "ripple", "userCache.py"),
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "ripple", "topScores.py"),
+)
+
+# MySQL client error codes meaning that the connection to the server is unusable
+CONNECTION_ERRORS = {
+    2002,  # CR_CONNECTION_ERROR
+    2003,  # CR_CONN_HOST_ERROR
+    2006,  # CR_SERVER_GONE_ERROR
+    2013,  # CR_SERVER_LOST
+}
+
+# MySQL errors raised when a statement is interrupted because it took too long
+# (KILL QUERY, MAX_EXECUTION_TIME, MariaDB's max_statement_time)
+QUERY_TIMEOUT_ERRORS = {1317, 3024, 1969}
+
+# Matches the SELECT keyword that gets the MAX_EXECUTION_TIME optimizer hint
+SELECT_REGEX = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+# MySQL errors that roll back the statement (or the whole transaction)
+# and are likely to go away if it's run again (deadlock, lock wait timeout)
+TRANSIENT_ERRORS = {1205, 1213}
+
+# Replica selection strategies
+REPLICA_ROUND_ROBIN = 0
+REPLICA_LEAST_BUSY = 1
+
+
+class record(tuple):
+    """
+    Base class of the record types returned with ROW_RECORD
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+
+def recordClass(columns):
+    """
+    Create a record type with the given column names
+
+    :param columns: column names, in the same order as the result set
+    :return: a `record` subclass
+    """
+    base = namedtuple("recordBase", columns, rename=True)
+    return type("record", (record, base), {"__slots__": ()})
+
+
+def mysqlBackend():
+    """
+    Return the default backend, MySQLdb.
+    It's imported only when it's used, so the other backends work without it.
+
+    :return: MySQLdb module
+    """
+    import MySQLdb.cursors
+
+    return MySQLdb
+
+
+class poolExhaustedError(Exception):
+    pass
+
+
+class queryTimeoutError(Exception):
+    pass
+
+
+class retryPolicy:
+    """
+    Retry policy for transient MySQL errors, with capped exponential backoff and full jitter
+    """
+
+    __slots__ = ("maxRetries", "baseDelay", "maxDelay")
+
+    def __init__(self, maxRetries=3, baseDelay=0.05, maxDelay=1.0):
+        """
+        Initialize a retry policy
+
+        :param maxRetries: max number of retries of a single query
+        :param baseDelay: max delay before the first retry, in seconds.
+                        It doubles at every retry.
+        :param maxDelay: cap of the delay between retries, in seconds
+        """
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+
+    def shouldRetry(self, error, attempt, idempotent, atomic=True):
+        """
+        Return True if a failed query should be run again.
+        Deadlocks and lock wait timeouts roll the statement back, so atomic statements
+        are always retried. After a connection error we can't tell if the statement
+        was applied, so only idempotent ones are retried.
+
+        :param error: MySQLdb.OperationalError raised by the query
+        :param attempt: number of retries done so far
+        :param idempotent: if True, the query can safely be run more than once
+        :param atomic: if False, the query may have been partially applied (eg: executemany)
+        :return: True if the query should be retried
+        """
+        code = error.args[0] if error.args else None
+        if code in TRANSIENT_ERRORS:
+            if not (atomic or idempotent):
+                return False
+        elif code not in CONNECTION_ERRORS or not idempotent:
+            return False
+        if attempt >= self.maxRetries:
+            glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.retries_exhausted")
+            return False
+        glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.retries")
+        log.debug(f"Retrying query after MySQL error {code} (attempt {attempt + 1})")
+        return True
+
+    def wait(self, attempt):
+        """
+        Sleep before a retry
+
+        :param attempt: number of retries done so far
+        :return:
+        """
+        time.sleep(random.uniform(0, min(self.maxDelay, self.baseDelay * 2**attempt)))
+
 
 class worker:
     """
     A single MySQL worker
     """
 
-    __slots__ = ("connection", "temporary")
+    __slots__ = (
+        "connection",
+        "temporary",
+        "createdAt",
+        "lastUsed",
+        "broken",
+    )
 
     def __init__(self, connection, temporary=False):
         """
@@ -26,6 +192,9 @@ class worker:
         """
         self.connection = connection
         self.temporary = temporary
+        self.createdAt = self.lastUsed = time.monotonic()
+        # If True, the worker is closed instead of going back to the pool
+        self.broken = False
         log.debug(f"Created MySQL worker. Temporary: {self.temporary}")
 
     def ping(self):
@@ -34,11 +203,12 @@ class worker:
 
         :return: True if connected, False if error occured.
         """
-        c = self.connection.cursor(MySQLdb.cursors.DictCursor)
+        c = self.connection.cursor()
         try:
             c.execute("SELECT 1+1")
             return True
-        except MySQLdb.Error:
+        except Exception:
+            # Whatever the backend raised, the connection can't be used
             return False
         finally:
             c.close()
@@ -57,9 +227,48 @@ class connectionsPool:
     A MySQL workers pool
     """
 
-    __slots__ = ("config", "maxSize", "pool", "consecutiveEmptyPool")
+    __slots__ = (
+        "config",
+        "maxSize",
+        "minSize",
+        "pool",
+        "consecutiveEmptyPool",
+        "acquireTimeout",
+        "maxOverflow",
+        "overflow",
+        "opened",
+        "lock",
+        "maxIdleTime",
+        "maxLifetime",
+        "validateAfter",
+        "lastReap",
+        "warmupThreads",
+        "ready",
+        "warmupTime",
+        "affinityTimeout",
+        "parked",
+        "lastReclaim",
+        "backend",
+    )
 
-    def __init__(self, host, username, password, database, size=128):
+    def __init__(
+        self,
+        host,
+        username,
+        password,
+        database,
+        size=128,
+        acquireTimeout=None,
+        maxOverflow=0,
+        minSize=None,
+        maxIdleTime=None,
+        maxLifetime=None,
+        validateAfter=None,
+        initialConnections=4,
+        warmupThreads=8,
+        affinityTimeout=None,
+        backend=None,
+    ):
         """
         Initialize a MySQL connections pool
 
@@ -68,12 +277,71 @@ class connectionsPool:
         :param password: MySQL password
         :param database: MySQL database name
         :param size: pool max size
+        :param acquireTimeout: if not None, enable bounded acquisition: wait up to this
+                                many milliseconds for a free worker, then raise poolExhaustedError.
+                                If None, spawn a temporary worker every time the pool is empty.
+        :param maxOverflow: max number of temporary workers that can be alive at the same time
+                            when bounded acquisition is enabled. Default: 0
+        :param minSize: number of workers opened on startup and never reaped.
+                        The pool grows on demand up to `size`. If None, same as `size`.
+        :param maxIdleTime: close workers that have been idle for more than this many seconds,
+                            as long as there are more than `minSize` workers. If None, never reap.
+        :param maxLifetime: close workers that are older than this many seconds. If None, never recycle.
+        :param validateAfter: ping workers that have been idle for more than this many seconds
+                            before returning them. If None, never validate.
+        :param initialConnections: number of workers opened synchronously on startup.
+                                    The rest of the `minSize` workers are opened in the background.
+                                    If None, open all of them synchronously. Default: 4
+        :param warmupThreads: number of connections opened in parallel while warming up. Default: 8
+        :param affinityTimeout: if not None, every thread keeps the last worker it used and gets it
+                                back on its next query without touching the shared queue.
+                                Workers kept for more than this many seconds without being used
+                                go back to the shared queue. If None, always use the shared queue.
+                                Workers are kept only while the shared queue has other idle
+                                workers, and never with acquireTimeout, where threads may be
+                                waiting for a worker.
+        :param backend: module implementing the subset of the MySQLdb API used by the pool
+                        (connect, cursors, Error, OperationalError), eg: common.db.sqliteBackend.
+                        If None, use MySQLdb.
         """
         self.config = (host, username, password, database)
         self.maxSize = size
-        self.pool = Queue(self.maxSize)
+        self.minSize = size if minSize is None else minSize
+        self.pool = LifoQueue(self.maxSize)
         self.consecutiveEmptyPool = 0
-        self.fillPool()
+        self.acquireTimeout = acquireTimeout
+        self.maxOverflow = maxOverflow
+        self.overflow = 0
+        self.opened = 0
+        self.lock = Lock()
+        self.maxIdleTime = maxIdleTime
+        self.maxLifetime = maxLifetime
+        self.validateAfter = validateAfter
+        self.lastReap = time.monotonic()
+        self.warmupThreads = warmupThreads
+        self.ready = Event()
+        self.warmupTime = None
+        self.affinityTimeout = affinityTimeout
+        # thread id -> worker kept for that thread
+        self.parked = {} if affinityTimeout is not None else None
+        self.lastReclaim = time.monotonic()
+        self.backend = backend if backend is not None else mysqlBackend()
+
+        # Open the initial workers, then warm up the rest in the background
+        start = time.perf_counter()
+        if initialConnections is None:
+            initialConnections = self.minSize
+        initialConnections = min(initialConnections, self.minSize)
+        if initialConnections:
+            self.fillPool(initialConnections)
+        if self.minSize > initialConnections:
+            Thread(
+                target=self.warmUp,
+                args=(self.minSize - initialConnections, start),
+                daemon=True,
+            ).start()
+        else:
+            self.warmedUp(start)
 
     def newWorker(self, temporary=False):
         """
@@ -82,7 +350,7 @@ class connectionsPool:
         :param temporary: if True, flag the worker as temporary
         :return: instance of worker class
         """
-        db = MySQLdb.connect(
+        db = self.backend.connect(
             *self.config,
             autocommit=True,
             charset="utf8",
@@ -91,6 +359,37 @@ class connectionsPool:
         conn = worker(db, temporary)
         return conn
 
+    def growPool(self):
+        """
+        Open a new non temporary worker, if the pool hasn't reached its max size.
+
+        :return: instance of worker class, or None if the pool is at max size
+        """
+        with self.lock:
+            if self.opened >= self.maxSize:
+                return None
+            self.opened += 1
+        try:
+            return self.newWorker()
+        except self.backend.OperationalError:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def dropWorker(self, worker):
+        """
+        Forget about a worker and close its connection
+
+        :param worker: worker object
+        :return:
+        """
+        with self.lock:
+            if worker.temporary:
+                self.overflow -= 1
+            else:
+                self.opened -= 1
+        del worker
+
     def fillPool(self, newConnections=0):
         """
         Fill the queue with workers
@@ -104,21 +403,175 @@ class connectionsPool:
 
         # Fill the pool
         for _ in range(newConnections):
-            if not self.pool.full():
-                self.pool.put_nowait(self.newWorker())
+            worker = self.growPool()
+            if worker is None:
+                break
+            worker.lastUsed = time.monotonic()
+            self.pool.put_nowait(worker)
+
+    def warmUp(self, newConnections, start):
+        """
+        Open workers in parallel until the pool has at least `minSize` workers.
+        Runs in a background thread started by __init__.
+
+        :param newConnections: max number of workers to open
+        :param start: perf_counter value of when the pool started filling
+        :return:
+        """
+
+        def openWorker():
+            # Don't open workers that the pool already opened on demand
+            with self.lock:
+                if self.opened >= self.minSize:
+                    return
+            worker = self.growPool()
+            if worker is None:
+                return
+            worker.lastUsed = time.monotonic()
+            try:
+                self.pool.put_nowait(worker)
+            except Full:
+                self.dropWorker(worker)
+
+        try:
+            with ThreadPoolExecutor(self.warmupThreads) as executor:
+                futures = [executor.submit(openWorker) for _ in range(newConnections)]
+                for future in futures:
+                    try:
+                        future.result()
+                    except self.backend.Error as e:
+                        log.warning(f"Can't open MySQL worker while warming up: {e}")
+        finally:
+            self.warmedUp(start)
+
+    def warmedUp(self, start):
+        """
+        Mark the pool as ready and report how long it took to fill it
+
+        :param start: perf_counter value of when the pool started filling
+        :return:
+        """
+        self.warmupTime = time.perf_counter() - start
+        self.ready.set()
+        log.debug(
+            f"MySQL connections pool ready with {self.opened} workers "
+            f"in {self.warmupTime * 1000:.2f}ms",
+        )
+        glob.dog.gauge(
+            f"{glob.DATADOG_PREFIX}.mysql_pool.warmup_time",
+            self.warmupTime * 1000,
+        )
+
+    def isUsable(self, worker):
+        """
+        Check if a pooled worker can be handed out.
+        Workers past their max lifetime are not usable, and workers that have been
+        idle for too long are pinged first.
+
+        :param worker: worker object
+        :return: True if the worker can be used, otherwise False
+        """
+        now = time.monotonic()
+        if self.maxLifetime is not None and now - worker.createdAt > self.maxLifetime:
+            return False
+        if (
+            self.validateAfter is not None
+            and now - worker.lastUsed > self.validateAfter
+        ):
+            return worker.ping()
+        return True
+
+    def popWorker(self):
+        """
+        Get a usable worker from the queue without waiting.
+        If the queue is empty, the pool grows if it hasn't reached its max size.
+
+        :return: instance of worker class, or None if no worker is available
+        """
+        if self.parked is not None:
+            worker = self.unparkWorker()
+            if worker is not None:
+                return worker
+        while True:
+            try:
+                worker = self.pool.get_nowait()
+            except Empty:
+                break
+            if self.isUsable(worker):
+                return worker
+            self.dropWorker(worker)
+        if self.parked:
+            # Take an idle worker kept by another thread before growing the pool
+            for ident in tuple(self.parked.copy()):
+                worker = self.parked.pop(ident, None)
+                if worker is None:
+                    continue
+                if self.isUsable(worker):
+                    return worker
+                self.dropWorker(worker)
+        return self.growPool()
+
+    def unparkWorker(self):
+        """
+        Get the worker kept for the current thread, if there's one.
+        No locks are involved, a dict pop is atomic.
+
+        :return: instance of worker class, or None
+        """
+        worker = self.parked.pop(get_ident(), None)
+        if worker is None:
+            return None
+        if self.isUsable(worker):
+            return worker
+        self.dropWorker(worker)
+        return None
+
+    def reclaimParked(self):
+        """
+        Put the workers that have been kept by a thread for more than
+        self.affinityTimeout seconds without being used back in the shared queue.
+        Called periodically by putWorker.
+
+        :return: number of reclaimed workers
+        """
+        now = self.lastReclaim = time.monotonic()
+        reclaimed = 0
+        for ident, worker in self.parked.copy().items():
+            if now - worker.lastUsed <= self.affinityTimeout:
+                continue
+            # The owner may have taken it back in the meantime
+            worker = self.parked.pop(ident, None)
+            if worker is None:
+                continue
+            try:
+                self.pool.put_nowait(worker)
+            except Full:
+                self.dropWorker(worker)
+            reclaimed += 1
+        return reclaimed
 
     def getWorker(self, level=0):
         """
         Get a MySQL connection worker from the pool.
         If the pool is empty, a new temporary worker is created.
+        If bounded acquisition is enabled, acquireWorker is used instead.
 
         :param level: number of failed connection attempts. If > 50, return None
         :return: instance of worker class
         """
+        # Fast path, reuse this thread's last worker
+        if self.parked is not None:
+            worker = self.unparkWorker()
+            if worker is not None:
+                return worker
+
         # Make sure we below 50 retries
         # log.info("Pool size: {}".format(self.pool.qsize()))
         glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.queries")
         glob.dog.gauge(f"{glob.DATADOG_PREFIX}.mysql_pool.size", self.pool.qsize())
+        if self.acquireTimeout is not None:
+            return self.acquireWorker()
+
         if level >= 50:
             log.warning(
                 "Too many failed connection attempts. No MySQL connection available.",
@@ -126,10 +579,13 @@ class connectionsPool:
             return None
 
         try:
-            if self.pool.empty():
+            worker = self.popWorker()
+            if worker is None:
                 # The pool is empty. Spawn a new temporary worker
                 log.warning("MySQL connections pool is empty. Using temporary worker.")
                 worker = self.newWorker(True)
+                with self.lock:
+                    self.overflow += 1
 
                 # Increment saturation
                 self.consecutiveEmptyPool += 1
@@ -141,11 +597,9 @@ class connectionsPool:
                     )
                     self.fillPool()
             else:
-                # The pool is not empty. Get worker from the pool
-                # and reset saturation counter
-                worker = self.pool.get()
+                # We got a worker from the pool, reset saturation counter
                 self.consecutiveEmptyPool = 0
-        except MySQLdb.OperationalError:
+        except self.backend.OperationalError:
             # Connection to server lost
             # Wait 1 second and try again
             log.warning("Can't connect to MySQL database. Retrying in 1 second...")
@@ -156,22 +610,180 @@ class connectionsPool:
         # Return the connection
         return worker
 
+    def acquireWorker(self):
+        """
+        Get a MySQL connection worker from the pool, waiting at most
+        self.acquireTimeout milliseconds.
+        If the pool is empty, a temporary worker is created only if there are
+        less than self.maxOverflow temporary workers alive.
+
+        :raise: poolExhaustedError if no worker becomes available in time
+        :return: instance of worker class
+        """
+        start = time.perf_counter()
+        try:
+            worker = self.popWorker()
+            if worker is not None:
+                return worker
+
+            # The pool is empty. Use an overflow worker if we haven't reached the cap
+            with self.lock:
+                canOverflow = self.overflow < self.maxOverflow
+                if canOverflow:
+                    self.overflow += 1
+            if canOverflow:
+                try:
+                    return self.newWorker(True)
+                except self.backend.OperationalError:
+                    with self.lock:
+                        self.overflow -= 1
+                    glob.dog.increment(
+                        f"{glob.DATADOG_PREFIX}.mysql_pool.failed_connections",
+                    )
+                    raise
+
+            # Wait for a worker to be returned to the pool
+            try:
+                return self.pool.get(timeout=self.acquireTimeout / 1000)
+            except Empty:
+                glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.exhausted")
+                raise poolExhaustedError(
+                    f"No MySQL worker available after {self.acquireTimeout}ms",
+                )
+        finally:
+            glob.dog.histogram(
+                f"{glob.DATADOG_PREFIX}.mysql_pool.acquire_wait",
+                (time.perf_counter() - start) * 1000,
+            )
+
     def putWorker(self, worker):
         """
-        Put the worker back in the pool.
-        If the worker is temporary, close the connection
-        and destroy the object
+        Put the worker back in the pool, or keep it for the current thread
+        if thread affinity is enabled.
+        If the worker is temporary, broken or past its max lifetime,
+        close the connection and destroy the object
 
         :param worker: worker object
         :return:
         """
-        if worker.temporary or self.pool.full():
-            # Kill the worker if it's temporary or the queue
-            # is full and we can't  put anything in it
-            del worker
+        now = time.monotonic()
+        if (
+            worker.temporary
+            or worker.broken
+            or (
+                self.maxLifetime is not None
+                and now - worker.createdAt > self.maxLifetime
+            )
+        ):
+            # Kill the worker if it's temporary, broken or too old
+            self.dropWorker(worker)
         else:
-            # Put the connection in the queue if there's space
-            self.pool.put_nowait(worker)
+            worker.lastUsed = now
+            if (
+                self.parked is not None
+                and self.acquireTimeout is None
+                and not self.pool.empty()
+                and self.parked.setdefault(get_ident(), worker) is worker
+            ):
+                # Kept for this thread's next query
+                pass
+            elif self.pool.full():
+                # The queue is full and we can't put anything in it
+                self.dropWorker(worker)
+            else:
+                # Put the connection in the queue if there's space
+                self.pool.put_nowait(worker)
+
+        # Give back the workers kept by threads that stopped using them
+        if self.parked is not None and now - self.lastReclaim > self.affinityTimeout:
+            self.reclaimParked()
+
+        # Close idle connections every now and then
+        if self.maxIdleTime is not None and now - self.lastReap > REAP_INTERVAL:
+            self.reapIdle()
+
+    def reapIdle(self):
+        """
+        Close the workers that have been idle for more than self.maxIdleTime seconds,
+        without going below self.minSize workers.
+        Called periodically by putWorker.
+
+        :return: number of closed workers
+        """
+        now = self.lastReap = time.monotonic()
+        with self.lock:
+            excess = self.opened - self.minSize
+        reaped = []
+        with self.pool.mutex:
+            # The queue is LIFO, so the least recently used workers are at the bottom
+            queue = self.pool.queue
+            while (
+                queue
+                and len(reaped) < excess
+                and now - queue[0].lastUsed > self.maxIdleTime
+            ):
+                reaped.append(queue.pop(0))
+            if reaped:
+                self.pool.not_full.notify(len(reaped))
+        for worker in reaped:
+            self.dropWorker(worker)
+        if reaped:
+            log.debug(f"Closed {len(reaped)} idle MySQL workers.")
+        return len(reaped)
+
+
+class session:
+    """
+    A set of queries running on a single pinned worker.
+    Returned by db.pinned() and db.transaction().
+    """
+
+    __slots__ = ("db", "worker")
+
+    def __init__(self, db, worker):
+        """
+        Initialize a session
+
+        :param db: db object that owns the worker
+        :param worker: pinned worker
+        """
+        self.db = db
+        self.worker = worker
+
+    def execute(self, query, params=None):
+        """
+        Executes a query on the pinned worker.
+        See db.execute.
+        """
+        return self.db.executeOn(self.worker, query, params)
+
+    def executeMany(self, query, paramsList):
+        """
+        Executes a query for every parameters set on the pinned worker.
+        See db.executeMany.
+        """
+        return self.db.executeManyOn(self.worker, query, paramsList)
+
+    def fetch(self, query, params=None, _all=False, rowType=ROW_DICT):
+        """
+        Fetch a single value on the pinned worker.
+        See db.fetch.
+        """
+        return self.db.fetchOn(self.worker, query, params, _all, rowType)
+
+    def fetchAll(self, query, params=None, rowType=ROW_DICT):
+        """
+        Fetch all values on the pinned worker.
+        See db.fetchAll.
+        """
+        return self.db.fetchOn(self.worker, query, params, True, rowType)
+
+    def fetchMulti(self, queries, rowType=ROW_DICT):
+        """
+        Fetch the results of several queries in a single round trip on the pinned worker.
+        See db.fetchMulti.
+        """
+        return self.db.fetchMultiOn(self.worker, queries, rowType)
 
 
 class db:
@@ -179,9 +791,43 @@ class db:
     A MySQL helper with multiple workers
     """
 
-    __slots__ = ("pool",)
+    __slots__ = (
+        "pool",
+        "recordClasses",
+        "replicas",
+        "replicaDownUntil",
+        "replicaCounter",
+        "replicaSelection",
+        "replicaCooldown",
+        "stickyWindow",
+        "local",
+        "tracer",
+        "stats",
+        "cache",
+        "counters",
+        "retryPolicy",
+    )
 
-    def __init__(self, host, username, password, database, initialSize):
+    def __init__(
+        self,
+        host,
+        username,
+        password,
+        database,
+        initialSize,
+        replicas=None,
+        replicaSelection=REPLICA_ROUND_ROBIN,
+        replicaCooldown=10,
+        stickyWindow=1,
+        tracing=False,
+        collectStats=False,
+        slowQueryThreshold=None,
+        cacheSize=10000,
+        counterFlushInterval=None,
+        counterMaxEntries=1000,
+        retryPolicy=None,
+        **poolOptions,
+    ):
         """
         Initialize a new MySQL database helper with multiple workers.
         This class is thread safe.
@@ -191,93 +837,952 @@ class db:
         :param password: MySQL password
         :param database: MySQL database name
         :param initialSize: initial pool size
+        :param replicas: list of read replicas. Each replica can be a host (same credentials
+                        as the primary) or a (host, username, password, database) tuple.
+                        fetch queries go to the replicas, everything else goes to the primary.
+        :param replicaSelection: REPLICA_ROUND_ROBIN or REPLICA_LEAST_BUSY
+        :param replicaCooldown: seconds a replica is skipped for after a connection error
+        :param stickyWindow: seconds after a write during which the same thread reads from the primary
+        :param tracing: if True, collect per-callsite query stats in self.tracer.
+                        Always enabled in debug mode.
+        :param collectStats: if True, collect per-query latency histograms and row counts in self.stats
+        :param slowQueryThreshold: log queries that take at least this many milliseconds.
+                                    Enables stats collection.
+        :param cacheSize: max number of results kept by the fetch cache (see fetch's cacheTtl)
+        :param counterFlushInterval: seconds between self.counters flushes.
+                                    If None, counter updates are written right away.
+        :param counterMaxEntries: flush self.counters as soon as this many rows are buffered
+        :param retryPolicy: retryPolicy object used to retry queries that failed with
+                            transient errors. If None, errors are always raised.
+        :param poolOptions: extra connectionsPool options
+                            (acquireTimeout, maxOverflow, minSize, maxIdleTime, backend, ...)
         """
-        self.pool = connectionsPool(host, username, password, database, initialSize)
+        self.pool = connectionsPool(
+            host,
+            username,
+            password,
+            database,
+            initialSize,
+            **poolOptions,
+        )
+        self.replicas = []
+        for replica in replicas or ():
+            if isinstance(replica, str):
+                replica = (replica, username, password, database)
+            self.replicas.append(
+                connectionsPool(*replica, initialSize, **poolOptions),
+            )
+        self.replicaDownUntil = [0.0] * len(self.replicas)
+        self.replicaCounter = count()
+        self.replicaSelection = replicaSelection
+        self.replicaCooldown = replicaCooldown
+        self.stickyWindow = stickyWindow
+        self.local = local()
+        self.tracer = (
+            queryTracer(skipFiles=TRACER_SKIP_FILES)
+            if tracing or settings.DEBUG
+            else None
+        )
+        self.stats = (
+            queryStats.queryStats(
+                self.tracer or queryTracer(skipFiles=TRACER_SKIP_FILES),
+                slowQueryThreshold,
+            )
+            if collectStats or slowQueryThreshold is not None
+            else None
+        )
+        self.cache = queryCache(cacheSize)
+        self.counters = counterBuffer(self, counterFlushInterval, counterMaxEntries)
+        self.retryPolicy = retryPolicy
+        # column names -> record type, see convertRows
+        self.recordClasses = {}
 
-    def execute(self, query, params=None):
+    def convertRows(self, cursor, rows, rowType):
         """
-        Executes a query
+        Convert tuple rows to `rowType`.
+        Dictionary rows are built by the cursor itself and are returned as they are.
+
+        :param cursor: cursor that produced the rows
+        :param rows: list of rows
+        :param rowType: one of the ROW_* constants
+        :return: list of converted rows
+        """
+        if rowType == ROW_SCALAR:
+            return [row[0] for row in rows]
+        if rowType == ROW_RECORD:
+            # Keyed by column names, so queries built on the fly don't add classes
+            columns = tuple(column[0] for column in cursor.description)
+            cls = self.recordClasses.get(columns)
+            if cls is None:
+                cls = self.recordClasses[columns] = recordClass(columns)
+            return [tuple.__new__(cls, row) for row in rows]
+        return rows
+
+    def replicasOrder(self):
+        """
+        Return the indexes of the healthy replicas, in the order they should be tried
+
+        :return: list of replica indexes
+        """
+        now = time.monotonic()
+        healthy = [
+            i for i, downUntil in enumerate(self.replicaDownUntil) if downUntil <= now
+        ]
+        if not healthy:
+            return healthy
+        if self.replicaSelection == REPLICA_LEAST_BUSY:
+            # The replica with the most idle workers first
+            return sorted(healthy, key=lambda i: -self.replicas[i].pool.qsize())
+        offset = next(self.replicaCounter) % len(healthy)
+        return healthy[offset:] + healthy[:offset]
+
+    def markReplicaDown(self, pool):
+        """
+        Skip a replica for self.replicaCooldown seconds
+
+        :param pool: connectionsPool of the replica
+        :return:
+        """
+        i = self.replicas.index(pool)
+        self.replicaDownUntil[i] = time.monotonic() + self.replicaCooldown
+        log.warning(f"MySQL replica {pool.config[0]} is unreachable.")
+        glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.replica_down")
+
+    def readWorker(self):
+        """
+        Get a worker for a read query.
+        Reads go to a healthy replica with a free worker, unless this thread
+        has written something in the last self.stickyWindow seconds.
+        If no replica can serve the query, the primary is used.
+
+        :return: (connectionsPool, worker) tuple
+        """
+        if (
+            self.replicas
+            and time.monotonic() - getattr(self.local, "lastWrite", float("-inf"))
+            > self.stickyWindow
+        ):
+            for i in self.replicasOrder():
+                pool = self.replicas[i]
+                try:
+                    worker = pool.popWorker()
+                except self.pool.backend.OperationalError:
+                    self.markReplicaDown(pool)
+                    continue
+                if worker is not None:
+                    glob.dog.increment(
+                        f"{glob.DATADOG_PREFIX}.mysql_pool.replica_queries",
+                    )
+                    return pool, worker
+        return self.pool, self.pool.getWorker()
+
+    def wrote(self):
+        """
+        Remember that this thread has just written something,
+        so its next reads go to the primary
+
+        :return:
+        """
+        if self.replicas:
+            self.local.lastWrite = time.monotonic()
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Share a time budget between all the queries run by this thread in the block.
+        Each query gets the time left as timeout, and queryTimeoutError is raised
+        once the budget is over. Nested deadlines can only shorten the budget.
+
+        :param seconds: time budget in seconds
+        :return:
+        """
+        previous = getattr(self.local, "deadline", None)
+        deadline = time.monotonic() + seconds
+        if previous is not None and previous < deadline:
+            deadline = previous
+        self.local.deadline = deadline
+        try:
+            yield
+        finally:
+            self.local.deadline = previous
+
+    def queryTimeout(self, timeout=None):
+        """
+        Return the timeout of the next query, taking this thread's deadline into account
+
+        :param timeout: timeout requested by the caller in seconds, or None
+        :return: timeout in seconds, or None if there's no limit
+        """
+        deadline = getattr(self.local, "deadline", None)
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.query_timeouts")
+            raise queryTimeoutError("Deadline exceeded")
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def killQuery(self, pool, threadID):
+        """
+        Interrupt the query running on a connection, using a temporary connection.
+        The temporary connection counts against the pool's overflow.
+
+        :param pool: connectionsPool that owns the connection
+        :param threadID: MySQL thread id of the connection
+        :return: True if the query has been killed
+        """
+        with pool.lock:
+            canOverflow = (
+                pool.acquireTimeout is None or pool.overflow < pool.maxOverflow
+            )
+            if canOverflow:
+                pool.overflow += 1
+        if not canOverflow:
+            log.warning(
+                f"Couldn't kill MySQL query on thread {threadID}: "
+                "no overflow connection available",
+            )
+            return False
+
+        try:
+            killer = pool.newWorker(temporary=True)
+        except pool.backend.Error as e:
+            with pool.lock:
+                pool.overflow -= 1
+            log.warning(f"Couldn't kill MySQL query on thread {threadID}: {e}")
+            return False
+        cursor = killer.connection.cursor()
+        try:
+            cursor.execute("KILL QUERY %s", [threadID])
+            return True
+        except pool.backend.Error as e:
+            log.warning(f"Couldn't kill MySQL query on thread {threadID}: {e}")
+            return False
+        finally:
+            cursor.close()
+            pool.dropWorker(killer)
+
+    @contextmanager
+    def watchdog(self, pool, worker, timeout):
+        """
+        Interrupt the query run in the block with KILL QUERY if it takes
+        more than `timeout` seconds, and raise queryTimeoutError.
+        Timed out workers are flagged as broken, so they're closed instead
+        of going back to the pool, even if the query couldn't be killed.
 
+        :param pool: connectionsPool that owns the worker
+        :param worker: worker running the query
+        :param timeout: timeout in seconds. If None, do nothing
+        :return:
+        """
+        if timeout is None:
+            yield
+            return
+
+        lock = Lock()
+        done = False
+        killed = False
+        threadID = worker.connection.thread_id()
+
+        def kill():
+            nonlocal killed
+            with lock:
+                if done:
+                    return
+                killed = True
+            # Connect outside of the lock, the block doesn't have to wait for it
+            # to finish. If the query ends in the meantime, the worker is closed anyway.
+            if not self.killQuery(pool, threadID):
+                worker.broken = True
+
+        timer = Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        except self.pool.backend.OperationalError as e:
+            if killed:
+                raise queryTimeoutError(f"Query took more than {timeout:.3f}s") from e
+            raise
+        finally:
+            timer.cancel()
+            with lock:
+                done = True
+            if killed:
+                worker.broken = True
+                glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_pool.query_timeouts")
+
+    def recordQuery(self, callsite, start, query, params, waitTime, cursor):
+        """
+        Add a query to the tracer and stats, if they're enabled
+
+        :param callsite: callsite label, if the tracer is enabled
+        :param start: perf_counter value of when the query started
+        :param query: query string
+        :param params: query parameters
+        :param waitTime: time spent waiting for the worker, in seconds
+        :param cursor: cursor that ran the query, if it was created
+        :return:
+        """
+        elapsed = time.perf_counter() - start
+        if self.tracer is not None:
+            self.tracer.record(callsite, elapsed)
+        if self.stats is not None:
+            rows = max(cursor.rowcount, 0) if cursor is not None else 0
+            self.stats.record(query, params, waitTime, elapsed, rows, callsite)
+
+    def executeOn(
+        self,
+        worker,
+        query,
+        params=None,
+        waitTime=0.0,
+        timeout=None,
+        pool=None,
+    ):
+        """
+        Executes a query on a specific worker
+
+        :param worker: worker to use
         :param query: query to execute. You can bind parameters with %s
         :param params: parameters list. First element replaces first %s and so on
+        :param waitTime: time spent waiting for the worker, in seconds. Used for stats
+        :param timeout: kill the query if it takes more than this many seconds. See watchdog.
+        :param pool: connectionsPool that owns the worker. Default: primary pool
+        :return: last inserted row id
         """
-        if settings.DEBUG:
-            # print sql queries
-            stack = []
-            for frame in inspect.stack()[1:]:
-                if frame.function == "handle":  # TODO: better
-                    break
-                stack.append(frame.function)
-            delim = " \x1b[0;92m->\x1b[0m "
-            print(f"execute ({delim.join(reversed(stack))})")
+        traced = self.tracer is not None or self.stats is not None
+        if traced:
+            callsite = self.tracer.callsite("execute") if self.tracer else None
+            start = time.perf_counter()
 
         if params is None:
             params = ()
         cursor = None
-        worker = self.pool.getWorker()
-        if worker is None:
-            return None
         try:
             # Create cursor, execute query and commit
-            cursor = worker.connection.cursor(MySQLdb.cursors.DictCursor)
-            cursor.execute(query, params)
+            cursor = worker.connection.cursor(self.pool.backend.cursors.DictCursor)
+            with self.watchdog(pool or self.pool, worker, timeout):
+                cursor.execute(query, params)
             log.debug(query)
             return cursor.lastrowid
         finally:
-            # Close the cursor and release worker's lock
+            if traced:
+                self.recordQuery(callsite, start, query, params, waitTime, cursor)
+            # Close the cursor
             if cursor:
                 cursor.close()
-            if worker:
-                self.pool.putWorker(worker)
 
-    def fetch(self, query, params=None, _all=False):
+    def executeManyOn(
+        self,
+        worker,
+        query,
+        paramsList,
+        waitTime=0.0,
+        timeout=None,
+        pool=None,
+    ):
         """
-        Fetch a single value from db that matches given query
+        Executes the same query once for every parameters set on a specific worker
 
+        :param worker: worker to use
+        :param query: query to execute. You can bind parameters with %s
+        :param paramsList: list of parameters lists, one for each row
+        :param waitTime: time spent waiting for the worker, in seconds. Used for stats
+        :param timeout: kill the batch if it takes more than this many seconds. See watchdog.
+        :param pool: connectionsPool that owns the worker. Default: primary pool
+        :return: number of affected rows
+        """
+        if not paramsList:
+            return 0
+        traced = self.tracer is not None or self.stats is not None
+        if traced:
+            callsite = self.tracer.callsite("executeMany") if self.tracer else None
+            start = time.perf_counter()
+
+        cursor = None
+        try:
+            # Create cursor and send the whole batch
+            cursor = worker.connection.cursor(self.pool.backend.cursors.DictCursor)
+            with self.watchdog(pool or self.pool, worker, timeout):
+                affectedRows = cursor.executemany(query, paramsList)
+            log.debug(f"{query} (x{len(paramsList)})")
+            return affectedRows
+        finally:
+            if traced:
+                self.recordQuery(
+                    callsite,
+                    start,
+                    query,
+                    f"({len(paramsList)} parameters sets)",
+                    waitTime,
+                    cursor,
+                )
+            # Close the cursor
+            if cursor:
+                cursor.close()
+
+    def fetchOn(
+        self,
+        worker,
+        query,
+        params=None,
+        _all=False,
+        rowType=ROW_DICT,
+        waitTime=0.0,
+        timeout=None,
+        pool=None,
+    ):
+        """
+        Fetch one or all values that match given query on a specific worker
+
+        :param worker: worker to use
         :param query: query to execute. You can bind parameters with %s
         :param params: parameters list. First element replaces first %s and so on
-        :param _all: fetch one or all values. Used internally. Use fetchAll if you want to fetch all values
+        :param _all: fetch one or all values
+        :param rowType: type of the returned rows, one of the ROW_* constants. Default: ROW_DICT
+        :param waitTime: time spent waiting for the worker, in seconds. Used for stats
+        :param timeout: max execution time in seconds. SELECT queries get a MAX_EXECUTION_TIME
+                        hint, so the server stops them, other queries are killed by the watchdog.
+        :param pool: connectionsPool that owns the worker. Default: primary pool
         """
-        if settings.DEBUG:
-            # print sql queries
-            stack = []
-            for frame in inspect.stack()[1:]:
-                if frame.function == "handle":  # TODO: better
-                    break
-                stack.append(frame.function)
-            delim = " \x1b[0;92m->\x1b[0m "
-            print(f"fetch ({delim.join(reversed(stack))})")
+        traced = self.tracer is not None or self.stats is not None
+        if traced:
+            callsite = self.tracer.callsite("fetch") if self.tracer else None
+            start = time.perf_counter()
 
         if params is None:
             params = ()
         cursor = None
-        worker = self.pool.getWorker()
-        if worker is None:
-            return None
         try:
             # Create cursor, execute the query and fetch one/all result(s)
-            cursor = worker.connection.cursor(MySQLdb.cursors.DictCursor)
-            cursor.execute(query, params)
+            cursor = worker.connection.cursor(
+                self.pool.backend.cursors.DictCursor
+                if rowType == ROW_DICT
+                else self.pool.backend.cursors.Cursor,
+            )
+            if timeout is not None and SELECT_REGEX.match(query):
+                # Let the server enforce the timeout
+                hinted = SELECT_REGEX.sub(
+                    f"SELECT /*+ MAX_EXECUTION_TIME({max(int(timeout * 1000), 1)}) */",
+                    query,
+                    1,
+                )
+                try:
+                    cursor.execute(hinted, params)
+                except self.pool.backend.OperationalError as e:
+                    if e.args[0] not in QUERY_TIMEOUT_ERRORS:
+                        raise
+                    glob.dog.increment(
+                        f"{glob.DATADOG_PREFIX}.mysql_pool.query_timeouts",
+                    )
+                    raise queryTimeoutError(
+                        f"Query took more than {timeout:.3f}s",
+                    ) from e
+            else:
+                with self.watchdog(pool or self.pool, worker, timeout):
+                    cursor.execute(query, params)
             log.debug(query)
             if _all:
-                return cursor.fetchall()
+                return self.convertRows(cursor, cursor.fetchall(), rowType)
             else:
-                return cursor.fetchone()
+                row = cursor.fetchone()
+                if row is None or rowType == ROW_DICT:
+                    return row
+                return self.convertRows(cursor, (row,), rowType)[0]
         finally:
-            # Close the cursor and release worker's lock
+            if traced:
+                self.recordQuery(callsite, start, query, params, waitTime, cursor)
+            # Close the cursor
             if cursor:
                 cursor.close()
-            if worker:
-                self.pool.putWorker(worker)
 
-    def fetchAll(self, query, params=None):
+    def fetchMultiOn(self, worker, queries, rowType=ROW_DICT, waitTime=0.0):
+        """
+        Fetch all the values that match several queries on a specific worker.
+        The queries are sent as a single multi statement batch.
+
+        :param worker: worker to use
+        :param queries: list of (query, params) tuples. params must be lists or tuples
+        :param rowType: type of the returned rows, one of the ROW_* constants. Default: ROW_DICT
+        :param waitTime: time spent waiting for the worker, in seconds. Used for stats
+        :return: list with a list of rows for each query
+        """
+        if not queries:
+            return []
+        query = "; ".join(q.rstrip().rstrip(";") for q, _ in queries)
+        params = [p for _, queryParams in queries for p in queryParams or ()]
+        traced = self.tracer is not None or self.stats is not None
+        if traced:
+            callsite = self.tracer.callsite("fetchMulti") if self.tracer else None
+            start = time.perf_counter()
+
+        cursor = None
+        try:
+            # Create cursor, send all the queries and read a result set for each one
+            cursor = worker.connection.cursor(
+                self.pool.backend.cursors.DictCursor
+                if rowType == ROW_DICT
+                else self.pool.backend.cursors.Cursor,
+            )
+            cursor.execute(query, params)
+            log.debug(query)
+            results = []
+            for _ in queries:
+                results.append(self.convertRows(cursor, cursor.fetchall(), rowType))
+                cursor.nextset()
+            return results
+        finally:
+            if traced:
+                self.recordQuery(callsite, start, query, params, waitTime, cursor)
+            # Close the cursor
+            if cursor:
+                cursor.close()
+
+    def invalidate(self, *tags):
+        """
+        Remove the cached results with at least one of the given tags.
+        Only this process' cache is invalidated, other processes
+        will see the change when their entries expire.
+        Writes made in a transaction should invalidate after the commit.
+
+        :param tags: tags to invalidate, usually table names
+        :return:
+        """
+        if tags and self.cache.invalidate(*tags):
+            glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_cache.invalidations")
+
+    def execute(
+        self,
+        query,
+        params=None,
+        invalidates=(),
+        timeout=None,
+        idempotent=False,
+        _attempt=0,
+    ):
+        """
+        Executes a query
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        :param invalidates: cache tags invalidated by this query. See fetch.
+        :param timeout: if the query takes more than this many seconds, it's killed
+                        and queryTimeoutError is raised. Limited by this thread's deadline.
+        :param idempotent: if True, the query is retried after connection errors too.
+                            See retryPolicy.shouldRetry.
+        :param _attempt: number of retries done so far. Used internally.
+        """
+        timeout = self.queryTimeout(timeout)
+        waitStart = time.perf_counter()
+        worker = self.pool.getWorker()
+        if worker is None:
+            return None
+        try:
+            return self.executeOn(
+                worker,
+                query,
+                params,
+                time.perf_counter() - waitStart,
+                timeout,
+            )
+        except self.pool.backend.OperationalError as e:
+            if e.args[0] in CONNECTION_ERRORS:
+                # Replace the worker instead of giving a dead connection back to the pool
+                worker.broken = True
+            if self.retryPolicy is None or not self.retryPolicy.shouldRetry(
+                e,
+                _attempt,
+                idempotent,
+            ):
+                raise
+        finally:
+            # Release worker's lock
+            self.pool.putWorker(worker)
+            self.wrote()
+            self.invalidate(*invalidates)
+
+        self.retryPolicy.wait(_attempt)
+        return self.execute(
+            query,
+            params,
+            invalidates,
+            timeout,
+            idempotent,
+            _attempt + 1,
+        )
+
+    def executeMany(
+        self,
+        query,
+        paramsList,
+        invalidates=(),
+        timeout=None,
+        idempotent=False,
+        _attempt=0,
+    ):
+        """
+        Executes the same query once for every parameters set, using a single worker.
+        INSERT/REPLACE ... VALUES queries are rewritten by the driver into
+        multi-row statements, so the whole batch costs a few round trips.
+
+        :param query: query to execute. You can bind parameters with %s
+        :param paramsList: list of parameters lists, one for each row
+        :param invalidates: cache tags invalidated by this query. See fetch.
+        :param timeout: if the batch takes more than this many seconds, it's killed
+                        and queryTimeoutError is raised. Limited by this thread's deadline.
+        :param idempotent: if True, the batch can be retried after transient errors.
+                            Not INSERT batches are run one statement at a time,
+                            so they're never retried unless they're idempotent.
+        :param _attempt: number of retries done so far. Used internally.
+        :return: number of affected rows
+        """
+        if not paramsList:
+            return 0
+        timeout = self.queryTimeout(timeout)
+        waitStart = time.perf_counter()
+        worker = self.pool.getWorker()
+        if worker is None:
+            return None
+        try:
+            return self.executeManyOn(
+                worker,
+                query,
+                paramsList,
+                time.perf_counter() - waitStart,
+                timeout,
+            )
+        except self.pool.backend.OperationalError as e:
+            if e.args[0] in CONNECTION_ERRORS:
+                # Replace the worker instead of giving a dead connection back to the pool
+                worker.broken = True
+            if self.retryPolicy is None or not self.retryPolicy.shouldRetry(
+                e,
+                _attempt,
+                idempotent,
+                atomic=False,
+            ):
+                raise
+        finally:
+            # Release worker's lock
+            self.pool.putWorker(worker)
+            self.wrote()
+            self.invalidate(*invalidates)
+
+        self.retryPolicy.wait(_attempt)
+        return self.executeMany(
+            query,
+            paramsList,
+            invalidates,
+            timeout,
+            idempotent,
+            _attempt + 1,
+        )
+
+    def fetch(
+        self,
+        query,
+        params=None,
+        _all=False,
+        rowType=ROW_DICT,
+        cacheTtl=None,
+        tags=(),
+        timeout=None,
+        _attempt=0,
+    ):
+        """
+        Fetch a single value from db that matches given query.
+        Reads are always retried according to self.retryPolicy.
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        :param _all: fetch one or all values. Used internally. Use fetchAll if you want to fetch all values
+        :param rowType: type of the returned rows, one of the ROW_* constants. Default: ROW_DICT
+        :param cacheTtl: if set, cache the result in this process for this many seconds.
+                        Cached rows are shared between callers, so don't modify them.
+                        None results (no matching row) are not cached.
+        :param tags: cache tags of the result (usually the tables it was read from).
+                    Writes with the same tags in `invalidates` remove it from the cache.
+        :param timeout: if the query takes more than this many seconds, it's interrupted
+                        and queryTimeoutError is raised. Limited by this thread's deadline.
+        :param _attempt: number of retries done so far. Used internally.
+        """
+        if cacheTtl is not None:
+            key = self.cache.key(query, params, _all, rowType)
+            if key is not None:
+                result = self.cache.get(key)
+                if result is not MISS:
+                    glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_cache.hits")
+                    return result
+                glob.dog.increment(f"{glob.DATADOG_PREFIX}.mysql_cache.misses")
+                generation = self.cache.generation
+                result = self.fetch(query, params, _all, rowType, timeout=timeout)
+                # Missing rows are not cached, they may be inserted right after
+                if result is not None:
+                    self.cache.set(key, result, cacheTtl, tags, generation)
+                return result
+
+        timeout = self.queryTimeout(timeout)
+        waitStart = time.perf_counter()
+        pool, worker = self.readWorker()
+        if worker is None:
+            return None
+        try:
+            return self.fetchOn(
+                worker,
+                query,
+                params,
+                _all,
+                rowType,
+                time.perf_counter() - waitStart,
+                timeout,
+                pool,
+            )
+        except self.pool.backend.OperationalError as e:
+            if pool is not self.pool and e.args[0] in CONNECTION_ERRORS:
+                # The replica went away, drop the worker and try somewhere else
+                self.markReplicaDown(pool)
+                pool.dropWorker(worker)
+                worker = None
+                return self.fetch(query, params, _all, rowType, timeout=timeout)
+            if e.args[0] in CONNECTION_ERRORS:
+                # Replace the worker instead of giving a dead connection back to the pool
+                worker.broken = True
+            if self.retryPolicy is None or not self.retryPolicy.shouldRetry(
+                e,
+                _attempt,
+                True,
+            ):
+                raise
+        finally:
+            # Release worker's lock
+            if worker is not None:
+                pool.putWorker(worker)
+
+        self.retryPolicy.wait(_attempt)
+        return self.fetch(
+            query,
+            params,
+            _all,
+            rowType,
+            timeout=timeout,
+            _attempt=_attempt + 1,
+        )
+
+    def fetchAll(
+        self,
+        query,
+        params=None,
+        rowType=ROW_DICT,
+        cacheTtl=None,
+        tags=(),
+        timeout=None,
+    ):
         """
         Fetch all values from db that match given query.
         Calls self.fetch with all = True.
 
         :param query: query to execute. You can bind parameters with %s
         :param params: parameters list. First element replaces first %s and so on
+        :param rowType: type of the returned rows, one of the ROW_* constants. Default: ROW_DICT
+        :param cacheTtl: if set, cache the result for this many seconds. See fetch.
+        :param tags: cache tags of the result. See fetch.
+        :param timeout: max execution time in seconds. See fetch.
+        """
+        if params is None:
+            params = ()
+        return self.fetch(
+            query,
+            params,
+            _all=True,
+            rowType=rowType,
+            cacheTtl=cacheTtl,
+            tags=tags,
+            timeout=timeout,
+        )
+
+    def fetchMulti(self, queries, rowType=ROW_DICT):
+        """
+        Fetch all the values that match several independent queries,
+        using a single worker and a single round trip.
+
+        :param queries: list of (query, params) tuples. You can bind parameters with %s,
+                        params must be lists or tuples
+        :param rowType: type of the returned rows, one of the ROW_* constants. Default: ROW_DICT
+        :return: list with a list of rows for each query
+        """
+        if not queries:
+            return []
+        waitStart = time.perf_counter()
+        pool, worker = self.readWorker()
+        if worker is None:
+            return None
+        try:
+            return self.fetchMultiOn(
+                worker,
+                queries,
+                rowType,
+                time.perf_counter() - waitStart,
+            )
+        except self.pool.backend.OperationalError as e:
+            if pool is self.pool or e.args[0] not in CONNECTION_ERRORS:
+                raise
+            # The replica went away, drop the worker and try somewhere else
+            self.markReplicaDown(pool)
+            pool.dropWorker(worker)
+            worker = None
+            return self.fetchMulti(queries, rowType)
+        finally:
+            # Release worker's lock
+            if worker is not None:
+                pool.putWorker(worker)
+
+    def fetchIter(self, query, params=None, batch=None, rowType=ROW_DICT):
+        """
+        Stream the values that match given query, using a server side cursor.
+        Rows are read from the server while they are consumed, so memory usage
+        doesn't depend on the size of the result set.
+        The worker goes back to the pool only when the iterator is exhausted or closed,
+        so don't leave it half consumed.
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        :param batch: if None, yield one row at a time. Otherwise, yield lists of up to `batch` rows
+        :param rowType: type of the returned rows, one of the ROW_* constants. Default: ROW_DICT
         """
         if params is None:
             params = ()
-        return self.fetch(query, params, _all=True)
+        cursor = None
+        pool, worker = self.readWorker()
+        if worker is None:
+            return
+        try:
+            # Create a server side cursor and execute the query
+            cursor = worker.connection.cursor(
+                self.pool.backend.cursors.SSDictCursor
+                if rowType == ROW_DICT
+                else self.pool.backend.cursors.SSCursor,
+            )
+            cursor.execute(query, params)
+            log.debug(query)
+            while True:
+                rows = cursor.fetchmany(batch or 1000)
+                if not rows:
+                    break
+                if rowType != ROW_DICT:
+                    rows = self.convertRows(cursor, rows, rowType)
+                if batch is None:
+                    yield from rows
+                else:
+                    yield rows
+        finally:
+            # Close the cursor (discarding unread rows) and release worker's lock
+            if cursor:
+                cursor.close()
+            if worker:
+                pool.putWorker(worker)
+
+    def fetchColumns(self, query, params=None, dtypes=None, batch=1000):
+        """
+        Fetch the values that match given query into numpy arrays, one for each column.
+        Rows are streamed with a server side cursor and copied straight into
+        preallocated arrays, that grow as needed, so no per-row objects are kept around.
+        Meant for bulk jobs. numpy is imported only when this is called.
+
+        :param query: query to execute. You can bind parameters with %s
+        :param params: parameters list. First element replaces first %s and so on
+        :param dtypes: dictionary with column names as keys and numpy dtypes as values.
+                        Default dtype: float64 (NULL values become nan).
+                        Integer dtypes can't hold NULL values.
+        :param batch: number of rows read from the server at a time. Default: 1000
+        :return: dictionary with column names as keys and numpy arrays as values
+        """
+        import numpy as np
+
+        if params is None:
+            params = ()
+        if dtypes is None:
+            dtypes = {}
+        cursor = None
+        pool, worker = self.readWorker()
+        if worker is None:
+            return None
+        try:
+            # Create a server side cursor and execute the query
+            cursor = worker.connection.cursor(self.pool.backend.cursors.SSCursor)
+            cursor.execute(query, params)
+            log.debug(query)
+            names = [column[0] for column in cursor.description]
+            capacity = batch
+            arrays = [
+                np.empty(capacity, dtypes.get(name, np.float64)) for name in names
+            ]
+            n = 0
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                end = n + len(rows)
+                if end > capacity:
+                    capacity = max(capacity * 2, end)
+                    for array in arrays:
+                        array.resize(capacity, refcheck=False)
+                for i, array in enumerate(arrays):
+                    array[n:end] = [row[i] for row in rows]
+                n = end
+            for array in arrays:
+                array.resize(n, refcheck=False)
+            return dict(zip(names, arrays))
+        finally:
+            # Close the cursor and release worker's lock
+            if cursor:
+                cursor.close()
+            if worker:
+                pool.putWorker(worker)
+
+    @contextmanager
+    def pinned(self):
+        """
+        Pin a single worker for a block of queries, without a transaction.
+        Use it like this:
+        ```
+        with glob.db.pinned() as s:
+            s.execute(...)
+            s.fetch(...)
+        ```
+
+        :return: session bound to the pinned worker
+        """
+        worker = self.pool.getWorker()
+        if worker is None:
+            raise self.pool.backend.OperationalError("No MySQL connection available.")
+        try:
+            yield session(self, worker)
+        finally:
+            # Release worker's lock
+            self.pool.putWorker(worker)
+            self.wrote()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block of queries in a single transaction on a pinned worker.
+        The transaction is committed when the block exits
+        and rolled back if an exception is raised inside it.
+        Use it like this:
+        ```
+        with glob.db.transaction() as tx:
+            tx.execute(...)
+            tx.execute(...)
+        ```
+
+        :return: session bound to the pinned worker
+        """
+        with self.pinned() as s:
+            s.worker.connection.begin()
+            try:
+                yield s
+            except BaseException:
+                s.worker.connection.rollback()
+                raise
+            s.worker.connection.commit()
@@ -0,0 +1,102 @@
+"""
+connectionsPool contention benchmark.
+Measures the cost of the pool bookkeeping alone (no queries are sent, workers
+wrap dummy connections), with and without thread affinity.
+
+Usage: python -m common.db.poolBenchmark [threads] [requests per thread] [queries per request]
+"""
+from __future__ import annotations
+
+import sys
+import time
+from threading import Barrier
+from threading import Thread
+
+from common.db.dbConnector import connectionsPool
+
+
+class dummyConnection:
+    """
+    A connection that does nothing
+    """
+
+    __slots__ = ()
+
+    def close(self):
+        pass
+
+
+class dummyError(Exception):
+    pass
+
+
+class dummyOperationalError(dummyError):
+    pass
+
+
+class dummyBackend:
+    """
+    connectionsPool backend whose connections don't connect to anything,
+    so the benchmark runs without MySQLdb
+    """
+
+    __slots__ = ()
+
+    Error = dummyError
+    OperationalError = dummyOperationalError
+
+    @staticmethod
+    def connect(*args, **kwargs):
+        return dummyConnection()
+
+
+def run(threads=128, requests=1000, queries=4, affinityTimeout=None):
+    """
+    Run `threads` threads, each one running `requests` requests of `queries` queries
+
+    :param threads: number of threads
+    :param requests: number of requests run by each thread
+    :param queries: number of getWorker/putWorker cycles in each request
+    :param affinityTimeout: connectionsPool affinityTimeout option
+    :return: worker checkouts per second
+    """
+    pool = connectionsPool(
+        "",
+        "",
+        "",
+        "",
+        size=threads,
+        minSize=threads,
+        initialConnections=None,
+        affinityTimeout=affinityTimeout,
+        backend=dummyBackend,
+    )
+    barrier = Barrier(threads + 1)
+
+    def work():
+        barrier.wait()
+        for _ in range(requests):
+            for _ in range(queries):
+                pool.putWorker(pool.getWorker())
+            # Let the other threads run, like a request handler waiting for I/O would
+            time.sleep(0)
+
+    workers = [Thread(target=work) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    start = time.perf_counter()
+    barrier.wait()
+    for t in workers:
+        t.join()
+    return threads * requests * queries / (time.perf_counter() - start)
+
+
+def main(argv):
+    threads, requests, queries = (int(x) for x in (argv + [128, 1000, 4][len(argv) :]))
+    for name, affinityTimeout in (("shared queue", None), ("thread affinity", 1)):
+        rate = run(threads, requests, queries, affinityTimeout)
+        print(f"{name}: {rate:,.0f} checkouts/s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
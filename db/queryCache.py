@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Returned by queryCache.get when a key is not cached (None is a valid cached result)
+MISS = object()
+
+
+class queryCache:
+    """
+    Bounded LRU cache for query results, with per-entry TTL.
+    Every entry can be tagged (usually with the names of the tables it was read from),
+    so writes can invalidate all the entries that depend on a table.
+    """
+
+    __slots__ = (
+        "maxSize",
+        "entries",
+        "tags",
+        "lock",
+        "hits",
+        "misses",
+        "generation",
+        "removedKeys",
+        "removedTags",
+        "floor",
+    )
+
+    def __init__(self, maxSize=10000):
+        """
+        Initialize a query cache
+
+        :param maxSize: max number of cached results. The least recently used ones are evicted first
+        """
+        self.maxSize = maxSize
+        # key -> (expiresAt, tags, value)
+        self.entries = OrderedDict()
+        # tag -> set of keys
+        self.tags = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every discard, invalidate and clear, so a value read while
+        # its key or one of its tags was being invalidated is not cached
+        self.generation = 0
+        # key -> generation of its last discard
+        self.removedKeys = {}
+        # tag -> generation of its last invalidation
+        self.removedTags = {}
+        # Values read before this generation are never cached
+        self.floor = 0
+
+    @staticmethod
+    def key(query, params, *args):
+        """
+        Build the cache key of a query
+
+        :param query: query string
+        :param params: query parameters
+        :param args: other values the result depends on (row type, fetch all...)
+        :return: hashable key, or None if params can't be hashed
+        """
+        if params is None:
+            params = ()
+        elif isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        elif not isinstance(params, tuple):
+            params = tuple(params)
+        key = (query, params, *args)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """
+        Return a cached value
+
+        :param key: cache key
+        :return: cached value, or MISS if it's not cached or it has expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            if entry[0] <= time.monotonic():
+                self.remove(key)
+                self.misses += 1
+                return MISS
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl, tags=(), generation=None):
+        """
+        Cache a value
+
+        :param key: cache key
+        :param value: value to cache
+        :param ttl: seconds the value is valid for
+        :param tags: tags of the value, used by invalidate()
+        :param generation: self.generation read before reading the value. If the key
+                        or one of the tags has been invalidated since then,
+                        the value is not cached.
+        :return: True if the value was cached
+        """
+        tags = tuple(tags)
+        with self.lock:
+            if generation is not None and self.isStale(key, tags, generation):
+                return False
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + ttl, tags, value)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.maxSize:
+                self.remove(next(iter(self.entries)))
+            return True
+
+    def isStale(self, key, tags, generation):
+        """
+        Check if a key or one of its tags has been invalidated after `generation`.
+        The lock must be held by the caller.
+
+        :param key: cache key
+        :param tags: tags of the value
+        :param generation: self.generation read before reading the value
+        :return: True if the value must not be cached
+        """
+        if generation < self.floor or self.removedKeys.get(key, -1) > generation:
+            return True
+        return any(self.removedTags.get(tag, -1) > generation for tag in tags)
+
+    def forget(self, removed, name):
+        """
+        Record that a key or a tag has been invalidated.
+        The lock must be held by the caller.
+
+        :param removed: self.removedKeys or self.removedTags
+        :param name: key or tag
+        :return:
+        """
+        self.generation += 1
+        removed[name] = self.generation
+        if len(self.removedKeys) + len(self.removedTags) > self.maxSize:
+            # Forget the old invalidations, and the values read before them
+            self.removedKeys.clear()
+            self.removedTags.clear()
+            self.floor = self.generation
+
+    def remove(self, key):
+        """
+        Remove an entry and its tags references.
+        The lock must be held by the caller.
+
+        :param key: cache key
+        :return:
+        """
+        _, tags, _ = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def discard(self, key):
+        """
+        Remove an entry, if it's cached
+
+        :param key: cache key
+        :return: True if the entry was cached
+        """
+        with self.lock:
+            self.forget(self.removedKeys, key)
+            if key not in self.entries:
+                return False
+            self.remove(key)
+            return True
+
+    def invalidate(self, *tags):
+        """
+        Remove all the entries with at least one of the given tags
+
+        :param tags: tags to invalidate
+        :return: number of removed entries
+        """
+        removed = 0
+        with self.lock:
+            for tag in tags:
+                self.forget(self.removedTags, tag)
+                for key in self.tags.pop(tag, ()):
+                    if key in self.entries:
+                        self.remove(key)
+                        removed += 1
+        return removed
+
+    def clear(self):
+        """
+        Remove all the entries
+
+        :return:
+        """
+        with self.lock:
+            self.generation += 1
+            self.floor = self.generation
+            self.removedKeys.clear()
+            self.removedTags.clear()
+            self.entries.clear()
+            self.tags.clear()
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from threading import Lock
+
+from common.log import logUtils as log
+
+# Upper bounds (in milliseconds) of the latency histograms buckets.
+# The last bucket holds everything slower than the last bound.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Max number of queries whose fingerprint is cached
+MAX_FINGERPRINTS = 10000
+
+fingerprintRegexes = (
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\""), "?"),  # string literals
+    (re.compile(r"%\(\w+\)s|%s"), "?"),  # placeholders
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),  # number literals
+    # IN (...) lists and VALUES rows
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"\s+"), " "),  # whitespace
+)
+
+
+def fingerprint(query):
+    """
+    Normalize a query, so all the queries with the same shape
+    and different parameters have the same fingerprint.
+
+    :param query: query string
+    :return: fingerprint string
+    """
+    for regex, replacement in fingerprintRegexes:
+        query = regex.sub(replacement, query)
+    return query.strip()
+
+
+class queryStats:
+    """
+    In-memory per-query statistics: pool wait and execution time histograms,
+    row counts and slow queries log.
+    """
+
+    __slots__ = ("slowQueryThreshold", "tracer", "fingerprints", "stats", "lock")
+
+    def __init__(self, tracer, slowQueryThreshold=None):
+        """
+        Initialize a query stats collector
+
+        :param tracer: queryTracer used to find the callsite of slow queries
+        :param slowQueryThreshold: log queries that take at least this many milliseconds.
+                                    If None, don't log slow queries.
+        """
+        self.tracer = tracer
+        self.slowQueryThreshold = slowQueryThreshold
+        self.fingerprints = {}
+        self.stats = {}
+        self.lock = Lock()
+
+    def fingerprint(self, query):
+        """
+        Cached version of fingerprint()
+
+        :param query: query string
+        :return: fingerprint string
+        """
+        result = self.fingerprints.get(query)
+        if result is None:
+            result = fingerprint(query)
+            if len(self.fingerprints) < MAX_FINGERPRINTS:
+                self.fingerprints[query] = result
+        return result
+
+    def record(self, query, params, waitTime, execTime, rows, callsite=None):
+        """
+        Add a query to its fingerprint stats and log it if it was slow
+
+        :param query: query string
+        :param params: query parameters
+        :param waitTime: time spent waiting for a pool worker, in seconds
+        :param execTime: time spent running the query, in seconds
+        :param rows: number of returned or affected rows
+        :param callsite: callsite label, if it's known already
+        :return:
+        """
+        key = self.fingerprint(query)
+        waitMs = waitTime * 1000
+        execMs = execTime * 1000
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = {
+                    "count": 0,
+                    "rows": 0,
+                    "wait_total": 0.0,
+                    "exec_total": 0.0,
+                    "exec_max": 0.0,
+                    "wait_histogram": [0] * (len(BUCKETS) + 1),
+                    "exec_histogram": [0] * (len(BUCKETS) + 1),
+                }
+            stats["count"] += 1
+            stats["rows"] += rows
+            stats["wait_total"] += waitMs
+            stats["exec_total"] += execMs
+            if execMs > stats["exec_max"]:
+                stats["exec_max"] = execMs
+            stats["wait_histogram"][bisect_left(BUCKETS, waitMs)] += 1
+            stats["exec_histogram"][bisect_left(BUCKETS, execMs)] += 1
+
+        if self.slowQueryThreshold is not None and execMs >= self.slowQueryThreshold:
+            if callsite is None:
+                callsite = self.tracer.caller()[1]
+            log.warning(
+                f"Slow query ({execMs:.2f}ms, waited {waitMs:.2f}ms for a worker) "
+                f"from {callsite}: {key} {params}",
+            )
+
+    def reset(self):
+        """
+        Forget all the collected stats
+
+        :return:
+        """
+        with self.lock:
+            self.stats = {}
+
+    def snapshot(self):
+        """
+        Return a copy of the collected stats
+
+        :return: dictionary with fingerprints as keys and stats dictionaries as values
+        """
+        with self.lock:
+            return {
+                k: {
+                    **v,
+                    "wait_histogram": list(v["wait_histogram"]),
+                    "exec_histogram": list(v["exec_histogram"]),
+                }
+                for k, v in self.stats.items()
+            }
+
+    def dump(self, limit=None):
+        """
+        Log the collected stats, slowest fingerprints (by total execution time) first
+
+        :param limit: max number of fingerprints to log. If None, log all of them
+        :return: list of (fingerprint, stats) tuples
+        """
+        rows = sorted(
+            self.snapshot().items(),
+            key=lambda row: row[1]["exec_total"],
+            reverse=True,
+        )
+        if limit is not None:
+            rows = rows[:limit]
+        for key, stats in rows:
+            n = stats["count"]
+            log.info(
+                f"{key}: {n} queries, {stats['rows']} rows, "
+                f"{stats['exec_total'] / n:.3f}ms avg exec, {stats['exec_max']:.3f}ms max exec, "
+                f"{stats['wait_total'] / n:.3f}ms avg wait",
+            )
+        return rows
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import sys
+from threading import Lock
+
+import settings
+from common.log import logUtils as log
+
+
+class queryTracer:
+    """
+    Cheap query callsite tracer.
+    Finds the function that ran a query by walking frame objects (no source lookups)
+    and aggregates count and latency of the queries run by each callsite.
+    """
+
+    __slots__ = ("skipFiles", "labels", "stats", "lock")
+
+    def __init__(self, skipFiles=()):
+        """
+        Initialize a query tracer
+
+        :param skipFiles: file names whose frames are skipped when looking for the caller
+                        (usually the db connector module itself). This module is always skipped.
+        """
+        self.skipFiles = frozenset((__file__, *skipFiles))
+        self.labels = {}
+        self.stats = {}
+        self.lock = Lock()
+
+    def caller(self):
+        """
+        Return the innermost frame outside of self.skipFiles and its label
+
+        :return: (frame, label) tuple. frame is None if it couldn't be found
+        """
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_filename in self.skipFiles:
+            frame = frame.f_back
+        if frame is None:
+            return None, "?"
+
+        key = (frame.f_code, frame.f_lineno)
+        label = self.labels.get(key)
+        if label is None:
+            code = frame.f_code
+            label = f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+            self.labels[key] = label
+        return frame, label
+
+    def callsite(self, kind):
+        """
+        Return a label for the function that is running a query.
+        In debug mode, the call chain is printed too.
+
+        :param kind: query kind (execute, fetch...), used only in the debug output
+        :return: callsite label, eg: `getUsername (ripple/userUtils.py:340)`
+        """
+        frame, label = self.caller()
+
+        if settings.DEBUG:
+            # print sql queries
+            stack = []
+            while frame is not None and frame.f_code.co_name != "handle":
+                stack.append(frame.f_code.co_name)
+                frame = frame.f_back
+            delim = " \x1b[0;92m->\x1b[0m "
+            print(f"{kind} ({delim.join(reversed(stack))})")
+
+        return label
+
+    def record(self, label, elapsed):
+        """
+        Add a query to a callsite stats
+
+        :param label: callsite label, returned by callsite()
+        :param elapsed: query duration in seconds
+        :return:
+        """
+        with self.lock:
+            stats = self.stats.get(label)
+            if stats is None:
+                self.stats[label] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+
+    def reset(self):
+        """
+        Forget all the collected stats
+
+        :return:
+        """
+        with self.lock:
+            self.stats = {}
+
+    def dump(self, limit=None):
+        """
+        Log the collected stats, slowest callsites (by total time) first
+
+        :param limit: max number of callsites to log. If None, log all of them
+        :return: list of (label, count, total seconds, max seconds) tuples
+        """
+        with self.lock:
+            rows = [(k, v[0], v[1], v[2]) for k, v in self.stats.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        for label, n, total, maximum in rows:
+            log.info(
+                f"{label}: {n} queries, {total * 1000:.2f}ms total, "
+                f"{total / n * 1000:.3f}ms avg, {maximum * 1000:.3f}ms max",
+            )
+        return rows
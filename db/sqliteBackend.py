@@ -0,0 +1,376 @@
+"""
+SQLite stand-in for MySQLdb, to be used as connectionsPool backend
+(`dbConnector.db(..., backend=sqliteBackend)`) in tests and benchmarks.
+
+It implements the subset of the MySQLdb API used by dbConnector and translates
+the MySQL syntax used by our helpers (%s placeholders, ON DUPLICATE KEY UPDATE,
+INSERT IGNORE, UPDATE ... LIMIT, identifiers starting with a digit, UNIX_TIMESTAMP(),
+CONCAT(), multi statements, KILL QUERY).
+The `database` connection argument is a SQLite file name, or `:memory:` for an in-memory
+database shared by all the connections of the process. host, username and password are ignored.
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+import sys
+import time
+from functools import lru_cache
+from itertools import count
+
+# MySQLdb.cursors is a module with the cursor classes, so is this one
+cursors = sys.modules[__name__]
+
+# MySQL error codes of the SQLite errors dbConnector cares about
+ERROR_CODES = (
+    ("interrupted", 1317),
+    ("locked", 1205),
+    ("busy", 1205),
+    ("no such table", 1146),
+    ("no such column", 1054),
+    ("syntax error", 1064),
+)
+UNKNOWN_ERROR = 2000
+
+placeholderRegexes = (
+    (re.compile(r"%\((\w+)\)s"), r":\1"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"%%"), "%"),
+)
+insertIgnoreRegex = re.compile(r"^\s*INSERT\s+IGNORE\b", re.IGNORECASE)
+onDuplicateRegex = re.compile(
+    r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+valuesFunctionRegex = re.compile(r"\bVALUES\s*\(\s*`?(\w+)`?\s*\)", re.IGNORECASE)
+updateLimitRegex = re.compile(
+    r"^(\s*(?:UPDATE|DELETE)\b.*?)\s+LIMIT\s+\d+\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+# Identifiers starting with a digit (2fa_totp) must be quoted in SQLite.
+# String literals and quoted identifiers are skipped.
+digitIdentifierRegex = re.compile(
+    r"('(?:[^'\\]|\\.|'')*'|`[^`]*`|\"[^\"]*\")|\b(?!0x)(\d+[A-Za-z_]\w*)",
+)
+forUpdateRegex = re.compile(r"\s+FOR\s+UPDATE\s*$", re.IGNORECASE)
+killQueryRegex = re.compile(r"^\s*KILL\s+QUERY\b", re.IGNORECASE)
+
+# thread id -> open sqlite3 connection, used by KILL QUERY
+connections = {}
+threadIDs = count(1)
+
+
+class Error(Exception):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class IntegrityError(Error):
+    pass
+
+
+def convertError(e):
+    """
+    Convert a sqlite3 exception to an exception of this module, with a MySQL error code
+
+    :param e: sqlite3.Error object
+    :return: Error object
+    """
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        return IntegrityError(1062, message)
+    code = UNKNOWN_ERROR
+    for text, mysqlCode in ERROR_CODES:
+        if text in message:
+            code = mysqlCode
+            break
+    return OperationalError(code, message)
+
+
+@lru_cache(maxsize=1024)
+def translate(query):
+    """
+    Translate a single MySQL statement to SQLite
+
+    :param query: MySQL query
+    :return: (SQLite query, number of positional placeholders) tuple
+    """
+    placeholders = query.count("%s") - query.count("%%s")
+    for regex, replacement in placeholderRegexes:
+        query = regex.sub(replacement, query)
+    query = digitIdentifierRegex.sub(
+        lambda m: m.group(1) or f'"{m.group(2)}"',
+        query,
+    )
+    query = insertIgnoreRegex.sub("INSERT OR IGNORE", query)
+    query = onDuplicateRegex.sub(
+        lambda m: "ON CONFLICT DO UPDATE SET"
+        + valuesFunctionRegex.sub(r"excluded.\1", m.group(1)),
+        query,
+    )
+    query = updateLimitRegex.sub(r"\1", query)
+    query = forUpdateRegex.sub("", query)
+    return query, placeholders
+
+
+@lru_cache(maxsize=1024)
+def splitStatements(query):
+    """
+    Split a multi statement query, ignoring the semicolons in string literals
+
+    :param query: query string
+    :return: tuple of statements
+    """
+    statements = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(query):
+        c = query[i]
+        if quote is not None:
+            if c == "\\":
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in "'\"`":
+            quote = c
+        elif c == ";":
+            statements.append(query[start:i])
+            start = i + 1
+        i += 1
+    statements.append(query[start:])
+    return tuple(s for s in statements if s.strip())
+
+
+def connect(host="", user="", password="", database=":memory:", **kwargs):
+    """
+    Open a connection. Same signature as MySQLdb.connect.
+
+    :param host: ignored
+    :param user: ignored
+    :param password: ignored
+    :param database: SQLite file name, or `:memory:` for the shared in-memory database
+    :param kwargs: ignored MySQLdb options
+    :return: connection object
+    """
+    return connection(database)
+
+
+class connection:
+    """
+    A SQLite connection with a MySQLdb connection interface.
+    Always in autocommit mode, unless begin() is called.
+    """
+
+    __slots__ = ("sqlite", "id")
+
+    def __init__(self, database):
+        """
+        Open a SQLite connection
+
+        :param database: SQLite file name, or `:memory:` for the shared in-memory database
+        """
+        if database == ":memory:":
+            self.sqlite = sqlite3.connect(
+                "file:common?mode=memory&cache=shared",
+                uri=True,
+                check_same_thread=False,
+                isolation_level=None,
+                timeout=5,
+            )
+        else:
+            self.sqlite = sqlite3.connect(
+                database,
+                check_same_thread=False,
+                isolation_level=None,
+                timeout=5,
+            )
+            self.sqlite.execute("PRAGMA journal_mode=WAL")
+        self.sqlite.create_function(
+            "UNIX_TIMESTAMP",
+            0,
+            lambda: int(time.time()),
+        )
+        self.sqlite.create_function(
+            "CONCAT",
+            -1,
+            lambda *args: None if None in args else "".join(str(x) for x in args),
+        )
+        self.sqlite.create_function("GREATEST", -1, max)
+        self.sqlite.create_function("LEAST", -1, min)
+        self.id = next(threadIDs)
+        connections[self.id] = self.sqlite
+
+    def cursor(self, cursorClass=None):
+        """
+        Create a cursor
+
+        :param cursorClass: one of this module's cursor classes. Default: Cursor
+        :return: cursor object
+        """
+        return (cursorClass or Cursor)(self)
+
+    def thread_id(self):
+        return self.id
+
+    def begin(self):
+        self.sqlite.execute("BEGIN")
+
+    def commit(self):
+        if self.sqlite.in_transaction:
+            self.sqlite.execute("COMMIT")
+
+    def rollback(self):
+        if self.sqlite.in_transaction:
+            self.sqlite.execute("ROLLBACK")
+
+    def close(self):
+        if connections.pop(self.id, None) is not None:
+            self.sqlite.close()
+
+
+class Cursor:
+    """
+    A cursor returning rows as tuples.
+    Result sets are read completely when the query is executed.
+    """
+
+    __slots__ = (
+        "connection",
+        "results",
+        "description",
+        "rows",
+        "rowcount",
+        "lastrowid",
+    )
+
+    def __init__(self, connection):
+        """
+        Initialize a cursor
+
+        :param connection: connection object
+        """
+        self.connection = connection
+        self.results = []
+        self.description = None
+        self.rows = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, query, args=None):
+        """
+        Execute one or more statements. See MySQLdb.cursors.Cursor.execute.
+
+        :param query: query string. You can bind parameters with %s
+        :param args: parameters list or dictionary
+        :return: number of affected rows
+        """
+        if killQueryRegex.match(query):
+            target = connections.get(int(args[0]))
+            if target is not None:
+                target.interrupt()
+            return 0
+
+        self.results = []
+        args = () if args is None else args
+        offset = 0
+        try:
+            for statement in splitStatements(query):
+                statement, placeholders = translate(statement)
+                if isinstance(args, dict):
+                    params = args
+                else:
+                    params = tuple(args[offset : offset + placeholders])
+                    offset += placeholders
+                c = self.connection.sqlite.execute(statement, params)
+                rows = c.fetchall() if c.description is not None else []
+                self.results.append(
+                    (
+                        c.description,
+                        rows,
+                        len(rows) if c.description is not None else c.rowcount,
+                        c.lastrowid,
+                    ),
+                )
+        except sqlite3.Error as e:
+            raise convertError(e) from e
+        self.nextset()
+        return self.rowcount
+
+    def executemany(self, query, args):
+        """
+        Execute a statement for every parameters set
+
+        :param query: query string. You can bind parameters with %s
+        :param args: list of parameters lists
+        :return: number of affected rows
+        """
+        statement, _ = translate(query)
+        try:
+            c = self.connection.sqlite.executemany(statement, args)
+        except sqlite3.Error as e:
+            raise convertError(e) from e
+        self.results = [(None, [], c.rowcount, c.lastrowid)]
+        self.nextset()
+        return self.rowcount
+
+    def nextset(self):
+        """
+        Move to the next result set
+
+        :return: True if there was another result set, else None
+        """
+        if not self.results:
+            self.description = None
+            self.rows = []
+            return None
+        self.description, self.rows, self.rowcount, self.lastrowid = self.results.pop(0)
+        return True
+
+    def convert(self, rows):
+        """
+        Convert raw rows to this cursor's row type
+
+        :param rows: list of tuples
+        :return: list of rows
+        """
+        return rows
+
+    def fetchone(self):
+        if not self.rows:
+            return None
+        return self.convert([self.rows.pop(0)])[0]
+
+    def fetchmany(self, size=1):
+        rows = self.rows[:size]
+        del self.rows[:size]
+        return self.convert(rows)
+
+    def fetchall(self):
+        rows = self.rows
+        self.rows = []
+        return self.convert(rows)
+
+    def close(self):
+        self.results = []
+        self.rows = []
+
+
+class DictCursor(Cursor):
+    """
+    A cursor returning rows as dictionaries
+    """
+
+    __slots__ = ()
+
+    def convert(self, rows):
+        names = [column[0] for column in self.description or ()]
+        return [dict(zip(names, row)) for row in rows]
+
+
+# Result sets are always read completely, server side cursors are the same as the others
+SSCursor = Cursor
+SSDictCursor = DictCursor
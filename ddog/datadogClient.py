@@ -72,6 +72,17 @@ class datadogClient:
         if self.client:
             self.client.gauge(*args, **kwargs)
 
+    def histogram(self, *args, **kwargs) -> None:
+        """
+        Call self.client.histogram(*args, **kwargs) if this client is not a dummy
+
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        if self.client:
+            self.client.histogram(*args, **kwargs)
+
     def __periodicCheckLoop(self) -> None:
         """Report periodic data to datadog."""
         if self.periodicChecks is not None:
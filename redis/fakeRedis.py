@@ -0,0 +1,333 @@
+"""
+In-process stand-in for a redis-py client (glob.redis), for tests and benchmarks.
+
+It implements the commands used by our helpers on strings, sets and sorted sets,
+key expiration and pub/sub, with redis-py's return types (values are returned as bytes).
+"""
+from __future__ import annotations
+
+import time
+from queue import Empty
+from queue import Queue
+from threading import Lock
+
+
+class wrongTypeError(Exception):
+    pass
+
+
+def encode(value):
+    """
+    Encode a value like redis-py does
+
+    :param value: bytes, str, int or float
+    :return: bytes
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return repr(value).encode("utf-8")
+
+
+class fakePubSub:
+    """
+    In-process stand-in for redis-py's PubSub object
+    """
+
+    __slots__ = ("redis", "channels", "messages")
+
+    def __init__(self, redis):
+        """
+        Initialize a pub/sub object
+
+        :param redis: fakeRedis object that publishes the messages
+        """
+        self.redis = redis
+        self.channels = set()
+        self.messages = Queue()
+
+    def subscribe(self, *channels):
+        """
+        Subscribe to some channels
+
+        :param channels: channel names, or lists of channel names
+        :return:
+        """
+        for channel in channels:
+            for name in [channel] if isinstance(channel, (str, bytes)) else channel:
+                name = encode(name)
+                self.redis.subscribe(self, name)
+                self.channels.add(name)
+                self.messages.put(
+                    {
+                        "type": "subscribe",
+                        "pattern": None,
+                        "channel": name,
+                        "data": len(self.channels),
+                    },
+                )
+
+    def unsubscribe(self, *channels):
+        """
+        Unsubscribe from some channels
+
+        :param channels: channel names. If empty, unsubscribe from all of them
+        :return:
+        """
+        for name in [encode(c) for c in channels] or list(self.channels):
+            self.redis.unsubscribe(self, name)
+            self.channels.discard(name)
+
+    def get_message(self, timeout=0):
+        """
+        Return the next message, if any
+
+        :param timeout: seconds to wait for a message
+        :return: message dictionary, or None
+        """
+        try:
+            if timeout:
+                return self.messages.get(timeout=timeout)
+            return self.messages.get_nowait()
+        except Empty:
+            return None
+
+    def listen(self):
+        """
+        Yield the received messages forever
+
+        :return: generator of message dictionaries
+        """
+        while True:
+            yield self.messages.get()
+
+    def close(self):
+        self.unsubscribe()
+
+
+class fakeRedis:
+    """
+    Thread safe, in-process stand-in for a redis-py client
+    """
+
+    __slots__ = ("data", "expires", "subscribers", "lock")
+
+    def __init__(self):
+        # key -> bytes, set of members or {member: score} dictionary
+        self.data = {}
+        # key -> expiration time (time.monotonic)
+        self.expires = {}
+        # channel -> set of fakePubSub objects
+        self.subscribers = {}
+        self.lock = Lock()
+
+    def lookup(self, name, kind=None):
+        """
+        Return the value of a key, removing it if it has expired.
+        The lock must be held by the caller.
+
+        :param name: key name, as bytes
+        :param kind: expected value type. If the key holds a different type, wrongTypeError is raised
+        :return: value, or None if the key doesn't exist
+        """
+        expiresAt = self.expires.get(name)
+        if expiresAt is not None and expiresAt <= time.monotonic():
+            del self.expires[name]
+            del self.data[name]
+            return None
+        value = self.data.get(name)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise wrongTypeError(
+                "WRONGTYPE Operation against a key holding the wrong kind of value",
+            )
+        return value
+
+    def remove(self, name):
+        """
+        Remove a key. The lock must be held by the caller.
+
+        :param name: key name, as bytes
+        :return: True if the key existed
+        """
+        self.expires.pop(name, None)
+        return self.data.pop(name, None) is not None
+
+    # Strings
+    def get(self, name):
+        with self.lock:
+            return self.lookup(encode(name), bytes)
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        """
+        Set a string value
+
+        :param name: key name
+        :param value: value
+        :param ex: expire time, in seconds
+        :param px: expire time, in milliseconds
+        :param nx: set the key only if it doesn't exist
+        :param xx: set the key only if it exists
+        :return: True if the key was set, else None
+        """
+        name = encode(name)
+        with self.lock:
+            exists = self.lookup(name) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+            self.remove(name)
+            self.data[name] = encode(value)
+            if ex is not None:
+                self.expires[name] = time.monotonic() + ex
+            elif px is not None:
+                self.expires[name] = time.monotonic() + px / 1000
+            return True
+
+    def incr(self, name, amount=1):
+        name = encode(name)
+        with self.lock:
+            value = int(self.lookup(name, bytes) or 0) + amount
+            self.data[name] = encode(value)
+            return value
+
+    # Keys
+    def delete(self, *names):
+        with self.lock:
+            return sum(
+                self.remove(name)
+                for name in map(encode, names)
+                if self.lookup(name) is not None
+            )
+
+    def exists(self, *names):
+        with self.lock:
+            return sum(self.lookup(encode(name)) is not None for name in names)
+
+    def expire(self, name, time_):
+        name = encode(name)
+        with self.lock:
+            if self.lookup(name) is None:
+                return False
+            self.expires[name] = time.monotonic() + time_
+            return True
+
+    # Sets
+    def sadd(self, name, *values):
+        name = encode(name)
+        with self.lock:
+            members = self.lookup(name, set)
+            if members is None:
+                members = self.data[name] = set()
+            size = len(members)
+            members.update(map(encode, values))
+            return len(members) - size
+
+    def srem(self, name, *values):
+        name = encode(name)
+        with self.lock:
+            members = self.lookup(name, set)
+            if members is None:
+                return 0
+            size = len(members)
+            members.difference_update(map(encode, values))
+            if not members:
+                self.remove(name)
+            return size - len(members)
+
+    def sismember(self, name, value):
+        with self.lock:
+            members = self.lookup(encode(name), set)
+            return members is not None and encode(value) in members
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self.lookup(encode(name), set) or ())
+
+    # Sorted sets
+    def zadd(self, name, mapping):
+        """
+        Add members to a sorted set, or update their scores
+
+        :param name: key name
+        :param mapping: {member: score} dictionary
+        :return: number of added members
+        """
+        name = encode(name)
+        with self.lock:
+            scores = self.lookup(name, dict)
+            if scores is None:
+                scores = self.data[name] = {}
+            size = len(scores)
+            scores.update((encode(k), float(v)) for k, v in mapping.items())
+            return len(scores) - size
+
+    def zrem(self, name, *values):
+        name = encode(name)
+        with self.lock:
+            scores = self.lookup(name, dict)
+            if scores is None:
+                return 0
+            removed = sum(scores.pop(encode(v), None) is not None for v in values)
+            if not scores:
+                self.remove(name)
+            return removed
+
+    def zscore(self, name, value):
+        with self.lock:
+            return (self.lookup(encode(name), dict) or {}).get(encode(value))
+
+    def zrevrank(self, name, value):
+        """
+        Return the 0-based rank of a member, ordered by score from high to low
+
+        :param name: key name
+        :param value: member
+        :return: rank, or None if the member isn't in the sorted set
+        """
+        value = encode(value)
+        with self.lock:
+            scores = self.lookup(encode(name), dict)
+            if scores is None or value not in scores:
+                return None
+            # Same order as redis: score, then member, both descending
+            entry = (scores[value], value)
+            return sum((s, m) > entry for m, s in scores.items())
+
+    # Pub/sub
+    def pubsub(self):
+        return fakePubSub(self)
+
+    def subscribe(self, pubSub, channel):
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(pubSub)
+
+    def unsubscribe(self, pubSub, channel):
+        with self.lock:
+            self.subscribers.get(channel, set()).discard(pubSub)
+
+    def publish(self, channel, message):
+        """
+        Send a message to the subscribers of a channel
+
+        :param channel: channel name
+        :param message: message
+        :return: number of subscribers that received the message
+        """
+        channel = encode(channel)
+        item = {
+            "type": "message",
+            "pattern": None,
+            "channel": channel,
+            "data": encode(message),
+        }
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for pubSub in subscribers:
+            # Every subscriber decodes the channel name in place
+            pubSub.messages.put(dict(item))
+        return len(subscribers)
+
+    def flushall(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
@@ -4,6 +4,7 @@ from typing import Optional
 from typing import Union
 
 from common.constants import mods
+from common.ripple import userUtils
 from objects import glob
 
 
@@ -38,57 +39,67 @@ def overwritePreviousScore(
     The ratelimit has already been checked in the case of the !overwrite command.
     """
 
-    # Figure out whether they would like
-    # to overwrite a relax or vanilla score
-    relax = glob.db.fetch(
-        "SELECT time, play_mode FROM scores_relax "
-        "WHERE userid = %s AND completed = 2 "
-        "ORDER BY id DESC LIMIT 1",
-        [userID],
-    )
-    vanilla = glob.db.fetch(
-        "SELECT time, play_mode FROM scores "
-        "WHERE userid = %s AND completed = 2 "
-        "ORDER BY id DESC LIMIT 1",
-        [userID],
-    )
-
-    if not (relax or vanilla):
-        return  # No scores?
-    elif not relax:
-        table = "scores"
-    elif not vanilla:
-        table = "scores_relax"
-    else:
-        table = "scores_relax" if relax["time"] > vanilla["time"] else "scores"
-
-    mode = relax["play_mode"] if table == "scores_relax" else vanilla["play_mode"]
-
-    # Select the users newest completed=2 score
-    result = glob.db.fetch(
-        "SELECT {0}.id, {0}.beatmap_md5, beatmaps.song_name FROM {0} "
-        "LEFT JOIN beatmaps USING(beatmap_md5) "
-        "WHERE {0}.userid = %s AND {0}.completed = 2 AND {0}.play_mode = %s "
-        "ORDER BY {0}.time DESC LIMIT 1".format(table),
-        [userID, mode],
-    )
-
-    # Set their previous completed scores on the map to completed = 2.
-    glob.db.execute(
-        f"UPDATE {table} SET completed = 2 "
-        "WHERE beatmap_md5 = %s AND (completed & 3) = 3 "
-        "AND userid = %s AND play_mode = %s",
-        [result["beatmap_md5"], userID, mode],
-    )
-
-    # Set their new score to completed = 3.
-    glob.db.execute(f"UPDATE {table} SET completed = 3 WHERE id = %s", [result["id"]])
-
-    # Update the last time they overwrote a score to the current time.
-    glob.db.execute(
-        "UPDATE users SET previous_overwrite = UNIX_TIMESTAMP() " "WHERE id = %s",
-        [userID],
-    )
+    with glob.db.transaction() as tx:
+        # Figure out whether they would like
+        # to overwrite a relax or vanilla score
+        relax, vanilla = tx.fetchMulti(
+            [
+                (
+                    "SELECT time, play_mode FROM scores_relax "
+                    "WHERE userid = %s AND completed = 2 "
+                    "ORDER BY id DESC LIMIT 1",
+                    [userID],
+                ),
+                (
+                    "SELECT time, play_mode FROM scores "
+                    "WHERE userid = %s AND completed = 2 "
+                    "ORDER BY id DESC LIMIT 1",
+                    [userID],
+                ),
+            ],
+        )
+        relax = relax[0] if relax else None
+        vanilla = vanilla[0] if vanilla else None
+
+        if not (relax or vanilla):
+            return  # No scores?
+        elif not relax:
+            table = "scores"
+        elif not vanilla:
+            table = "scores_relax"
+        else:
+            table = "scores_relax" if relax["time"] > vanilla["time"] else "scores"
+
+        mode = relax["play_mode"] if table == "scores_relax" else vanilla["play_mode"]
+
+        # Select the users newest completed=2 score
+        result = tx.fetch(
+            "SELECT {0}.id, {0}.beatmap_md5, beatmaps.song_name FROM {0} "
+            "LEFT JOIN beatmaps USING(beatmap_md5) "
+            "WHERE {0}.userid = %s AND {0}.completed = 2 AND {0}.play_mode = %s "
+            "ORDER BY {0}.time DESC LIMIT 1".format(table),
+            [userID, mode],
+        )
+
+        # Set their previous completed scores on the map to completed = 2.
+        tx.execute(
+            f"UPDATE {table} SET completed = 2 "
+            "WHERE beatmap_md5 = %s AND (completed & 3) = 3 "
+            "AND userid = %s AND play_mode = %s",
+            [result["beatmap_md5"], userID, mode],
+        )
+
+        # Set their new score to completed = 3.
+        tx.execute(f"UPDATE {table} SET completed = 3 WHERE id = %s", [result["id"]])
+
+        # Update the last time they overwrote a score to the current time.
+        tx.execute(
+            "UPDATE users SET previous_overwrite = UNIX_TIMESTAMP() " "WHERE id = %s",
+            [userID],
+        )
+
+    # The best scores have changed
+    userUtils.userTopScores.invalidate(userID)
 
     # Return song_name for the command to send back to the user
     return result["song_name"]
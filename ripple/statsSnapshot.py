@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Optional
+from typing import Tuple
+
+from common.constants import gameModes
+
+# relax_ap -> stats table
+TABLES = {0: "users_stats", 1: "rx_stats", 2: "ap_stats"}
+
+# Per-mode columns, in the same order as modeStats' slots
+COLUMNS = ("ranked_score", "avg_accuracy", "playcount", "total_score", "pp")
+# Only users_stats has per-mode playtime
+PLAYTIME_TABLES = ("users_stats",)
+
+MODES = (gameModes.STD, gameModes.TAIKO, gameModes.CTB, gameModes.MANIA)
+
+
+def buildQuery(table: str) -> Tuple[str, int]:
+    """
+    Build the query that reads all the modes' stats of a user from `table`
+
+    :param table: stats table name
+    :return: (query, number of columns per mode) tuple
+    """
+    columns = COLUMNS + (("playtime",) if table in PLAYTIME_TABLES else ())
+    selected = ", ".join(
+        f"{column}_{gameModes.getGameModeForDB(mode)}"
+        for mode in MODES
+        for column in columns
+    )
+    return f"SELECT {selected} FROM {table} WHERE id = %s LIMIT 1", len(columns)
+
+
+# relax_ap -> (query, number of columns per mode), built once
+QUERIES = {relax_ap: buildQuery(table) for relax_ap, table in TABLES.items()}
+
+
+class modeStats:
+    """
+    Stats of a user in a single game mode
+    """
+
+    __slots__ = ("rankedScore", "accuracy", "playcount", "totalScore", "pp", "playtime")
+
+    def __init__(
+        self,
+        rankedScore: int,
+        accuracy: float,
+        playcount: int,
+        totalScore: int,
+        pp: int,
+        playtime: Optional[int] = None,
+    ) -> None:
+        self.rankedScore = rankedScore
+        self.accuracy = accuracy
+        self.playcount = playcount
+        self.totalScore = totalScore
+        self.pp = pp
+        self.playtime = playtime
+
+
+class statsSnapshot:
+    """
+    Stats of a user in all game modes, read from a single stats table row.
+    Index it with a game mode number: `snapshot[gameModes.STD].pp`
+    """
+
+    __slots__ = ("userID", "relax_ap", "modes")
+
+    def __init__(self, userID: int, relax_ap: int, row: Tuple[Any, ...]) -> None:
+        """
+        Initialize a stats snapshot
+
+        :param userID: user id
+        :param relax_ap: 0 for vanilla, 1 for relax, 2 for autopilot
+        :param row: row read with QUERIES[relax_ap], as a tuple
+        """
+        self.userID = userID
+        self.relax_ap = relax_ap
+        size = QUERIES[relax_ap][1]
+        self.modes = tuple(
+            modeStats(*row[i * size : (i + 1) * size]) for i in range(len(MODES))
+        )
+
+    def __getitem__(self, gameMode: int) -> modeStats:
+        return self.modes[gameMode]
+
+    @property
+    def playtimeTotal(self) -> int:
+        return sum(mode.playtime or 0 for mode in self.modes)
@@ -0,0 +1,334 @@
+from __future__ import annotations
+
+import random
+from bisect import bisect_left
+from bisect import insort
+from threading import Lock
+from typing import Optional
+from typing import Tuple
+
+from common.db import dbConnector
+from common.db.queryCache import MISS
+from common.db.queryCache import queryCache
+from common.redis import generalPubSubHandler
+from objects import glob
+
+# Every process publishes "user id,origin" on this channel when a user's best scores change,
+# so the other processes drop their cached lists. User id 0 drops all of them.
+# Services that change scores without this module (wipes, ranked status changes)
+# must publish "user id,0" (or "0,0") here too.
+CHANNEL = "ripple:top_scores_invalidate"
+
+# Number of best scores that count for accuracy and pp
+TOP_SCORES = 125
+
+# Weight of the n-th best score, computed exactly like calculatePP and calculateAccuracy do
+PP_WEIGHTS = tuple(0.95**i for i in range(TOP_SCORES))
+ACCURACY_WEIGHTS = tuple(int((0.95**k) * 100) for k in range(TOP_SCORES))
+# ACCURACY_DIVISORS[n] is the sum of the first n accuracy weights
+ACCURACY_DIVISORS = tuple(sum(ACCURACY_WEIGHTS[:n]) for n in range(TOP_SCORES + 1))
+
+
+class topList:
+    """
+    A user's best scores in a game mode, ordered by pp (highest first) like
+    `ORDER BY pp DESC LIMIT 125`, with at most one score for each beatmap.
+    """
+
+    __slots__ = ("entries", "beatmaps", "truncated")
+
+    def __init__(self, rows) -> None:
+        """
+        Initialize a top scores list
+
+        :param rows: (score id, beatmap md5, pp, accuracy) rows, read with `LIMIT TOP_SCORES`
+        """
+        # (sort key, score id, beatmap md5, pp, accuracy), ascending sort key = descending pp
+        self.entries = []
+        # beatmap md5 -> entry
+        self.beatmaps = {}
+        for scoreID, md5, pp, accuracy in rows:
+            self.insert(scoreID, md5, pp, accuracy)
+        # If the query hit the limit, there may be more scores in the db than in the list
+        self.truncated = len(self.entries) >= TOP_SCORES
+
+    def insert(
+        self,
+        scoreID: int,
+        md5: str,
+        pp: Optional[float],
+        accuracy: float,
+    ) -> None:
+        # NULL pp are sorted last, like MySQL does
+        entry = (-pp if pp is not None else float("inf"), scoreID, md5, pp, accuracy)
+        insort(self.entries, entry)
+        self.beatmaps[md5] = entry
+
+    def add(
+        self,
+        scoreID: int,
+        md5: str,
+        pp: Optional[float],
+        accuracy: float,
+        counts: bool = True,
+    ) -> bool:
+        """
+        Replace the best score on a beatmap with a new one
+
+        :param scoreID: new best score id
+        :param md5: beatmap md5
+        :param pp: score pp
+        :param accuracy: score accuracy
+        :param counts: if False, the new score doesn't belong in this list,
+                        only the old best score on the beatmap is removed
+        :return: False if the list can't be kept exact without reading it again from the db
+        """
+        removed = False
+        old = self.beatmaps.get(md5)
+        if old is not None:
+            if old[1] == scoreID:
+                # Already in the list, it was read from the db after it was saved
+                return True
+            del self.beatmaps[md5]
+            del self.entries[bisect_left(self.entries, old)]
+            removed = True
+
+        if counts:
+            key = -pp if pp is not None else float("inf")
+            if len(self.entries) < TOP_SCORES or key < self.entries[-1][0]:
+                self.insert(scoreID, md5, pp, accuracy)
+                if len(self.entries) > TOP_SCORES:
+                    dropped = self.entries.pop()
+                    del self.beatmaps[dropped[2]]
+                    self.truncated = True
+
+        # The next best score, that isn't cached, should take the freed place
+        return not (removed and self.truncated and len(self.entries) < TOP_SCORES)
+
+    def pp(self) -> int:
+        """
+        Return the weighted total pp. Same as userUtils.calculatePP.
+
+        :return: total pp
+        """
+        return sum(
+            round(round(entry[3]) * weight)
+            for entry, weight in zip(self.entries, PP_WEIGHTS)
+        )
+
+    def accuracy(self) -> float:
+        """
+        Return the weighted average accuracy. Same as userUtils.calculateAccuracy.
+
+        :return: accuracy
+        """
+        if not self.entries:
+            return 0
+        totalAcc = 0
+        for entry, weight in zip(self.entries, ACCURACY_WEIGHTS):
+            totalAcc += entry[4] * weight
+        divideTotal = ACCURACY_DIVISORS[len(self.entries)]
+        return totalAcc / divideTotal if divideTotal != 0 else 0
+
+
+class topScoresCache:
+    """
+    Per-process LRU cache of the users' top scores lists, so accuracy and pp
+    can be updated after a new score without reading the whole top 125 again.
+    Every (user, game mode, relax) has two lists: all the best scores (accuracy)
+    and the best scores on ranked beatmaps with pp (pp).
+    Changes are published on CHANNEL, so the other processes drop their cached lists,
+    and lists expire after `ttl` seconds.
+    """
+
+    __slots__ = ("cache", "ttl", "lock", "origin")
+
+    def __init__(self, maxSize=10000, ttl=30):
+        """
+        Initialize a top scores cache
+
+        :param maxSize: max number of cached (user, game mode, relax) lists pairs
+        :param ttl: seconds a list is valid for. Bounds how long the score changes
+                    that are not published on CHANNEL take to be seen.
+        """
+        self.cache = queryCache(maxSize)
+        self.ttl = ttl
+        self.lock = Lock()
+        # Identifies this cache's messages on CHANNEL, that it doesn't need to handle
+        self.origin = random.getrandbits(62) + 1
+
+    @staticmethod
+    def load(userID: int, gameMode: int, relax: bool) -> Tuple[topList, topList]:
+        """
+        Read a user's top scores lists from the db, in a single round trip
+
+        :param userID: user id
+        :param gameMode: game mode number
+        :param relax: whether to read relax or classic scores
+        :return: (accuracy list, pp list) tuple
+        """
+        table = "scores_relax" if relax else "scores"
+        accuracyRows, ppRows = glob.db.fetchMulti(
+            [
+                (
+                    f"SELECT id, beatmap_md5, pp, accuracy FROM {table} "
+                    "WHERE userid = %s AND play_mode = %s "
+                    f"AND completed = 3 ORDER BY pp DESC LIMIT {TOP_SCORES}",
+                    [userID, gameMode],
+                ),
+                (
+                    f"SELECT {table}.id, {table}.beatmap_md5, pp, accuracy "
+                    f"FROM {table} LEFT JOIN(beatmaps) USING(beatmap_md5) "
+                    "WHERE userid = %s AND play_mode = %s AND completed = 3 "
+                    "AND ranked >= 2 AND ranked != 5 AND pp IS NOT NULL "
+                    f"ORDER BY pp DESC LIMIT {TOP_SCORES}",
+                    [userID, gameMode],
+                ),
+            ],
+            rowType=dbConnector.ROW_TUPLE,
+        )
+        return topList(accuracyRows), topList(ppRows)
+
+    def get(self, userID: int, gameMode: int, relax: bool) -> Tuple[topList, topList]:
+        """
+        Return a user's top scores lists, reading them from the db if they're not cached
+
+        :param userID: user id
+        :param gameMode: game mode number
+        :param relax: whether to get relax or classic scores
+        :return: (accuracy list, pp list) tuple
+        """
+        key = (userID, gameMode, relax)
+        lists = self.cache.get(key)
+        if lists is MISS:
+            # Lists read while the user's scores were being changed are not cached
+            generation = self.cache.generation
+            lists = self.load(userID, gameMode, relax)
+            self.cache.set(key, lists, self.ttl, (userID,), generation)
+        return lists
+
+    def accuracy(self, userID: int, gameMode: int, relax: bool) -> float:
+        accuracyList, _ = self.get(userID, gameMode, relax)
+        with self.lock:
+            return accuracyList.accuracy()
+
+    def pp(self, userID: int, gameMode: int, relax: bool) -> int:
+        _, ppList = self.get(userID, gameMode, relax)
+        with self.lock:
+            return ppList.pp()
+
+    def addScore(
+        self,
+        userID: int,
+        gameMode: int,
+        relax: bool,
+        scoreID: Optional[int],
+    ) -> None:
+        """
+        Update the cached lists after a score has been saved,
+        and drop them from the cache of the other processes.
+        Call it before reading the new accuracy and pp.
+
+        :param userID: user id
+        :param gameMode: game mode number
+        :param relax: whether the score is relax or classic
+        :param scoreID: id of the saved score. If None, the lists are read again from the db.
+        :return:
+        """
+        self.publish(userID)
+        key = (userID, gameMode, relax)
+        lists = self.cache.get(key)
+        if lists is MISS:
+            # They'll be read with the new score in them. Lists that are
+            # being read right now may not have it, don't cache them.
+            self.cache.discard(key)
+            return
+        if not scoreID:
+            self.discard(userID)
+            return
+
+        table = "scores_relax" if relax else "scores"
+        score = glob.db.fetch(
+            f"SELECT {table}.beatmap_md5, pp, accuracy, completed, ranked "
+            f"FROM {table} LEFT JOIN(beatmaps) USING(beatmap_md5) "
+            f"WHERE {table}.id = %s",
+            [scoreID],
+        )
+        if score is None or score["completed"] != 3:
+            # Not a new best score, the best scores are the same
+            return
+
+        ranked = score["ranked"]
+        accuracyList, ppList = lists
+        with self.lock:
+            exact = accuracyList.add(
+                scoreID,
+                score["beatmap_md5"],
+                score["pp"],
+                score["accuracy"],
+            ) & ppList.add(
+                scoreID,
+                score["beatmap_md5"],
+                score["pp"],
+                score["accuracy"],
+                score["pp"] is not None
+                and ranked is not None
+                and ranked >= 2
+                and ranked != 5,
+            )
+        if not exact:
+            self.discard(userID)
+
+    def discard(self, userID: int) -> None:
+        """
+        Drop all the cached lists of a user from this process' cache
+
+        :param userID: user id. If 0, drop all the cached lists.
+        :return:
+        """
+        if userID:
+            self.cache.invalidate(userID)
+        else:
+            self.cache.clear()
+
+    def publish(self, userID: int) -> None:
+        """
+        Tell the other processes to drop a user's cached lists
+
+        :param userID: user id. If 0, they drop all the cached lists.
+        :return:
+        """
+        glob.redis.publish(CHANNEL, f"{userID},{self.origin}")
+
+    def invalidate(self, userID: int) -> None:
+        """
+        Drop all the cached lists of a user from the cache of every process.
+        Call it after changing the user's scores.
+
+        :param userID: user id. If 0, drop all the cached lists.
+        :return:
+        """
+        self.discard(userID)
+        self.publish(userID)
+
+
+class invalidateHandler(generalPubSubHandler.generalPubSubHandler):
+    """
+    CHANNEL handler, to be registered in the process' redis.pubSub.listener:
+    `{topScores.CHANNEL: topScores.invalidateHandler(userUtils.userTopScores)}`
+    """
+
+    __slots__ = ("topScoresCache",)
+
+    def __init__(self, topScoresCache: topScoresCache) -> None:
+        super().__init__()
+        self.type = "int_list"
+        self.topScoresCache = topScoresCache
+
+    def handle(self, data: bytes) -> None:
+        message = self.parseData(data)
+        if message is None or len(message) != 2:
+            return
+        userID, origin = message
+        if origin != self.topScoresCache.origin:
+            self.topScoresCache.discard(userID)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Optional
+
+from common.db import dbConnector
+from common.db.queryCache import MISS
+from common.db.queryCache import queryCache
+from common.redis import generalPubSubHandler
+from objects import glob
+
+# Every process publishes the IDs of the users it changes on this channel,
+# so the other processes can drop their cached records
+CHANNEL = "ripple:user_cache_invalidate"
+
+RECORD_QUERY = (
+    "SELECT users.id, users.username, users.username_safe, users.privileges, "
+    "users.silence_end, users.frozen, users.donor_expire, "
+    "users_stats.country, clans.tag AS clan_tag "
+    "FROM users "
+    "LEFT JOIN users_stats ON users_stats.id = users.id "
+    "LEFT JOIN clans ON clans.id = users.clan_id "
+    "WHERE users.id = %s"
+)
+
+
+class userCache:
+    """
+    Per-process LRU cache of compact user records (the `users` columns read by
+    the userUtils getters, plus country and clan tag), fetched with a single query.
+    Records expire after `ttl` seconds, and are invalidated on all the processes
+    through CHANNEL when a user is changed with userUtils.
+    """
+
+    __slots__ = ("cache", "ttl")
+
+    def __init__(self, maxSize=10000, ttl=5):
+        """
+        Initialize a user records cache
+
+        :param maxSize: max number of cached records
+        :param ttl: seconds a record is valid for. Bounds how long the changes made
+                    without userUtils (that are not published on CHANNEL) take to be seen.
+        """
+        self.cache = queryCache(maxSize)
+        self.ttl = ttl
+
+    def get(self, userID: int) -> Optional[Any]:
+        """
+        Return a user's record, from the cache or from the db
+
+        :param userID: user id
+        :return: record object (supports both record.username and record["username"]),
+                or None if the user doesn't exist
+        """
+        result = self.cache.get(userID)
+        if result is not MISS:
+            return result
+
+        # A record read while the user was being changed is not cached
+        generation = self.cache.generation
+        result = glob.db.fetch(RECORD_QUERY, [userID], rowType=dbConnector.ROW_RECORD)
+        # Users that don't exist are not cached, they may be registering right now
+        if result is not None:
+            self.cache.set(userID, result, self.ttl, generation=generation)
+        return result
+
+    def discard(self, userID: int) -> None:
+        """
+        Drop a user's record from this process' cache
+
+        :param userID: user id
+        :return:
+        """
+        self.cache.discard(userID)
+
+    def invalidate(self, userID: int) -> None:
+        """
+        Drop a user's record from the cache of every process.
+        Call this after changing the user in the db.
+
+        :param userID: user id
+        :return:
+        """
+        self.discard(userID)
+        glob.redis.publish(CHANNEL, userID)
+
+
+class invalidateHandler(generalPubSubHandler.generalPubSubHandler):
+    """
+    CHANNEL handler, to be registered in the process' redis.pubSub.listener:
+    `{userCache.CHANNEL: userCache.invalidateHandler(userUtils.userRecords)}`
+    """
+
+    __slots__ = ("userCache",)
+
+    def __init__(self, userCache: userCache) -> None:
+        super().__init__()
+        self.type = "int"
+        self.userCache = userCache
+
+    def handle(self, data: bytes) -> None:
+        userID = self.parseData(data)
+        if userID is not None:
+            self.userCache.discard(userID)
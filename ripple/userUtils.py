@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import time
+from bisect import bisect_left
 from typing import Any
+from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Tuple
@@ -14,13 +16,36 @@ from common import generalUtils
 from common.constants import gameModes
 from common.constants import mods
 from common.constants import privileges
+from common.db import dbConnector
 from common.log import logUtils as log
 from common.ripple import passwordUtils
+from common.ripple import statsSnapshot
+from common.ripple import topScores
+from common.ripple import userCache
 from common.web.discord import Webhook
 from objects import glob
 from orjson import loads
 from requests import get
 
+# Seconds getMapNominator results are cached for. Beatmaps are not written
+# by this package, so changes to them are seen when the cached results expire.
+CACHE_TTL = 30
+# Seconds the user records (see userRecords) are cached for
+USER_CACHE_TTL = 5
+
+# Cached user records, read by the single-user getters of the `users` columns.
+# Writes made with this module are published on userCache.CHANNEL;
+# register userCache.invalidateHandler(userRecords) in the process' pubSub listener.
+userRecords = userCache.userCache(ttl=USER_CACHE_TTL)
+
+# Cached top 125 scores, used to update accuracy and pp after a new score.
+# Score changes are published on topScores.CHANNEL; register
+# topScores.invalidateHandler(userTopScores) in the process' pubSub listener.
+userTopScores = topScores.topScoresCache()
+
+# Max number of IDs in a single `WHERE id IN (...)` query of the batched getters
+ID_CHUNK_SIZE = 500
+
 
 def getBeatmapTime(beatmapID: int) -> Any:
     """
@@ -123,20 +148,13 @@ def incrementPlaytime(userID: int, gameMode: int = 0, length: int = 0) -> None:
     """
 
     modeForDB = gameModes.getGameModeForDB(gameMode)
-    result = glob.db.fetch(
-        "SELECT playtime_{gm} AS playtime FROM users_stats "
-        "WHERE id = %s".format(gm=modeForDB),
-        [userID],
-    )
-
-    if not result:
-        return
-
-    glob.db.execute(
-        "UPDATE users_stats SET playtime_{gm} = %s "
-        "WHERE id = %s".format(gm=modeForDB),
-        [int(result["playtime"] + length), userID],
+    glob.db.counters.increment(
+        "users_stats",
+        {"id": userID},
+        f"playtime_{modeForDB}",
+        int(length),
     )
+    glob.db.invalidate(statsTag(userID))
 
 
 def updateBeatmapPlaycount(userID: int, beatmapHash: str, gameMode: int, relax: bool):
@@ -149,11 +167,11 @@ def updateBeatmapPlaycount(userID: int, beatmapHash: str, gameMode: int, relax:
     :param gameMode: game mode Munber
     :param relax:
     """
-    glob.db.execute(
-        "INSERT INTO beatmaps_playcounts "
-        "VALUES (%s, %s, %s, %s, DEFAULT) "
-        "ON DUPLICATE KEY UPDATE COUNT = COUNT + 1",
-        [userID, beatmapHash, gameMode, relax],
+    glob.db.counters.increment(
+        "beatmaps_playcounts",
+        (userID, beatmapHash, gameMode, relax),
+        "COUNT",
+        upsert=True,
     )
 
 
@@ -165,14 +183,9 @@ def getPlaytime(userID: int, gameMode: int = 0) -> Optional[int]:
     :param gameMode: game mode number
     """
 
-    modeForDB = gameModes.getGameModeForDB(gameMode)
-    result = glob.db.fetch(
-        "SELECT playtime_{gm} as playtime FROM users_stats "
-        "WHERE id = %s".format(gm=modeForDB),
-        [userID],
-    )
+    snapshot = getStatsSnapshot(userID)
 
-    return result["playtime"] if result else None
+    return snapshot[gameMode].playtime if snapshot else None
 
 
 def getPlaytimeTotal(userID: int) -> int:
@@ -182,13 +195,9 @@ def getPlaytimeTotal(userID: int) -> int:
     :param userID:
     """
 
-    res = glob.db.fetch(
-        "SELECT playtime_std, playtime_ctb, playtime_mania, playtime_taiko "
-        "FROM users_stats WHERE id = %s",
-        [userID],
-    )
+    snapshot = getStatsSnapshot(userID)
 
-    return sum(res.values()) if res else 0
+    return snapshot.playtimeTotal if snapshot else 0
 
 
 def getWhitelist(userID: int) -> int:
@@ -233,6 +242,46 @@ def editWhitelist(userID: int, bit: int) -> None:
         userToken.whitelist = bit
 
 
+def statsTag(userID: int) -> str:
+    """
+    Return the query cache tag of `userID`'s stats snapshots.
+    Writes to the stats tables must invalidate it.
+
+    :param userID: user id
+    :return: cache tag
+    """
+
+    return f"stats:{userID}"
+
+
+def getStatsSnapshot(
+    userID: int,
+    relax_ap: int = 0,
+    cacheTtl: Optional[float] = None,
+) -> Optional[statsSnapshot.statsSnapshot]:
+    """
+    Get all the modes' stats of `userID` with a single query.
+
+    :param userID: user id
+    :param relax_ap: 0 for vanilla, 1 for relax, 2 for autopilot
+    :param cacheTtl: seconds the stats row is cached for. If None, always read it from db.
+                    The cache is per-process, so only pass it if the stats written
+                    by other processes can be seen that late.
+    :return: statsSnapshot object, or None if the user has no stats
+    """
+
+    query, _ = statsSnapshot.QUERIES[relax_ap]
+    row = glob.db.fetch(
+        query,
+        [userID],
+        rowType=dbConnector.ROW_TUPLE,
+        cacheTtl=cacheTtl,
+        tags=(statsTag(userID),),
+    )
+
+    return statsSnapshot.statsSnapshot(userID, relax_ap, row) if row else None
+
+
 def getUserStats(userID: int, gameMode: int, relax_ap: int) -> Any:
     """
     Get all user stats relative to `gameMode`.
@@ -242,30 +291,20 @@ def getUserStats(userID: int, gameMode: int, relax_ap: int) -> Any:
     :return: dictionary with result
     """
 
-    modeForDB = gameModes.getGameModeForDB(gameMode)
+    snapshot = getStatsSnapshot(userID, relax_ap)
+    if snapshot is None:
+        return None
 
-    table = "users_stats"
-    if relax_ap == 1:
-        table = "rx_stats"
-    elif relax_ap == 2:
-        table = "ap_stats"
-
-    # Get stats
-    stats = glob.db.fetch(
-        "SELECT ranked_score_{gm} AS rankedScore, "
-        "avg_accuracy_{gm} AS accuracy, "
-        "playcount_{gm} AS playcount, "
-        "total_score_{gm} AS totalScore, "
-        "pp_{gm} AS pp "
-        "FROM {table} WHERE id = %s LIMIT 1".format(gm=modeForDB, table=table),
-        [userID],
-    )
-
-    # Get game rank
-    stats["gameRank"] = getGameRank(userID, gameMode, relax_ap)
-
-    # Return stats + game rank
-    return stats
+    stats = snapshot[gameMode]
+    return {
+        "rankedScore": stats.rankedScore,
+        "accuracy": stats.accuracy,
+        "playcount": stats.playcount,
+        "totalScore": stats.totalScore,
+        "pp": stats.pp,
+        # Get game rank
+        "gameRank": getGameRank(userID, gameMode, relax_ap),
+    }
 
 
 def getIDSafe(_safeUsername: str) -> Optional[int]:
@@ -291,6 +330,8 @@ def getMapNominator(beatmapID: int) -> Optional[Any]:
     res = glob.db.fetch(
         "SELECT song_name, ranked, rankedby " "FROM beatmaps WHERE beatmap_id = %s",
         [beatmapID],
+        cacheTtl=CACHE_TTL,
+        tags=("beatmaps",),
     )
 
     return res if res else None
@@ -337,9 +378,53 @@ def getUsername(userID: int) -> Optional[str]:
     :return: username or None
     """
 
-    result = glob.db.fetch("SELECT username " "FROM users " "WHERE id = %s", [userID])
+    result = userRecords.get(userID)
+
+    return result.username if result else None
 
-    return result["username"] if result else None
+
+def fetchByIDs(
+    table: str,
+    column: str,
+    userIDs: List[int],
+    default: Any = None,
+) -> Dict[int, Any]:
+    """
+    Get a column of many users with chunked `WHERE id IN (...)` queries.
+
+    :param table: table name
+    :param column: column name
+    :param userIDs: list of user ids
+    :param default: value used for the users that don't exist
+    :return: dictionary with user ids as keys (in the same order as `userIDs`, without
+            duplicates) and column values as values
+    """
+
+    results = dict.fromkeys(userIDs, default)
+    ids = list(results)
+
+    for i in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[i : i + ID_CHUNK_SIZE]
+        rows = glob.db.fetchAll(
+            f"SELECT id, {column} FROM {table} "
+            f"WHERE id IN ({', '.join(['%s'] * len(chunk))})",
+            chunk,
+        )
+        for row in rows or ():
+            results[row["id"]] = row[column]
+
+    return results
+
+
+def getUsernames(userIDs: List[int]) -> Dict[int, Optional[str]]:
+    """
+    Get the usernames of many users.
+
+    :param userIDs: list of user ids
+    :return: dictionary with user ids as keys and usernames (None if the user doesn't exist) as values
+    """
+
+    return fetchByIDs("users", "username", userIDs)
 
 
 def getSafeUsername(userID: int) -> Optional[str]:
@@ -350,12 +435,9 @@ def getSafeUsername(userID: int) -> Optional[str]:
     :return: username or None
     """
 
-    result = glob.db.fetch(
-        "SELECT username_safe " "FROM users " "WHERE id = %s",
-        [userID],
-    )
+    result = userRecords.get(userID)
 
-    return result["username_safe"] if result else None
+    return result.username_safe if result else None
 
 
 def exists(userID: int) -> bool:
@@ -366,7 +448,7 @@ def exists(userID: int) -> bool:
     :return: True if the user exists, else False
     """
 
-    return glob.db.fetch("SELECT id FROM users " "WHERE id = %s", [userID]) is not None
+    return userRecords.get(userID) is not None
 
 
 def checkLogin(userID: int, password: str, ip: str = "") -> bool:
@@ -446,6 +528,15 @@ def getRequiredScoreForLevel(level):
         return 0x645395C2D + 100000000000 * (level - 100)
 
 
+# Levels above this one are not calculated, scores beyond its threshold get MAX_LEVEL + 1
+MAX_LEVEL = 130
+
+# Score required to reach each level from 1 to MAX_LEVEL (LEVEL_THRESHOLDS[0] is level 1)
+LEVEL_THRESHOLDS = [
+    getRequiredScoreForLevel(level) for level in range(1, MAX_LEVEL + 1)
+]
+
+
 def getLevel(totalScore: int):
     """
     Return level from totalScore
@@ -454,22 +545,23 @@ def getLevel(totalScore: int):
     :return: level
     """
 
-    level = 1
-    while True:
-        # if the level is > 130, it's probably an endless loop. terminate it.
-        if level > 130:
-            return level
+    # The level is the last one whose threshold is lower than totalScore
+    level = bisect_left(LEVEL_THRESHOLDS, totalScore)
+    return level if level < MAX_LEVEL else MAX_LEVEL + 1
 
-        # Calculate required score
-        reqScore = getRequiredScoreForLevel(level)
 
-        # Check if this is our level
-        if totalScore <= reqScore:
-            # Our level, return it and break
-            return level - 1
-        else:
-            # Not our level, calculate score for next level
-            level += 1
+def getLevels(totalScores: Any) -> Any:
+    """
+    Vectorized getLevel. Requires numpy.
+
+    :param totalScores: array-like of total scores
+    :return: numpy array of levels
+    """
+
+    import numpy as np
+
+    levels = np.searchsorted(LEVEL_THRESHOLDS, np.asarray(totalScores), side="left")
+    return np.where(levels < MAX_LEVEL, levels, MAX_LEVEL + 1)
 
 
 def updateLevel(
@@ -497,13 +589,22 @@ def updateLevel(
     table = "rx_stats" if relax else "users_stats"
 
     if totalScore == 0:
-        totalScore = glob.db.fetch(
-            f"SELECT total_score_{mode} as total_score " f"FROM {table} WHERE id = %s",
-            [userID],
-        )
 
-        if totalScore:
-            totalScore = totalScore["total_score"]
+        def read():
+            result = glob.db.fetch(
+                f"SELECT total_score_{mode} as total_score "
+                f"FROM {table} WHERE id = %s",
+                [userID],
+            )
+            return result["total_score"] if result else None
+
+        # Add the score that is still buffered
+        totalScore = glob.db.counters.withPending(
+            table,
+            {"id": userID},
+            f"total_score_{mode}",
+            read,
+        )
 
     # Calculate level from totalScore
     level = getLevel(totalScore)
@@ -533,6 +634,7 @@ def calculateAccuracy(userID: int, gameMode: int, relax: bool) -> float:
         "WHERE userid = %s AND play_mode = %s "
         "AND completed = 3 ORDER BY pp DESC LIMIT 125",
         [userID, gameMode],
+        rowType=dbConnector.ROW_SCALAR,
     )
 
     v = 0
@@ -541,9 +643,9 @@ def calculateAccuracy(userID: int, gameMode: int, relax: bool) -> float:
         totalAcc = 0
         divideTotal = 0
         k = 0
-        for i in bestAccScores:
+        for accuracy in bestAccScores:
             add = int((0.95**k) * 100)
-            totalAcc += i["accuracy"] * add
+            totalAcc += accuracy * add
             divideTotal += add
             k += 1
         # echo "$add - $totalacc - $divideTotal\n"
@@ -568,13 +670,14 @@ def calculatePP(userID: int, gameMode: int, relax: bool) -> int:
     # Get best pp scores
     table = "scores_relax" if relax else "scores"
     return sum(
-        round(round(row["pp"]) * 0.95**i)
-        for i, row in enumerate(
+        round(round(pp) * 0.95**i)
+        for i, pp in enumerate(
             glob.db.fetchAll(
                 f"SELECT pp FROM {table} LEFT JOIN(beatmaps) USING(beatmap_md5) "
                 "WHERE userid = %s AND play_mode = %s AND completed = 3 "
                 "AND ranked >= 2 AND ranked != 5 AND pp IS NOT NULL ORDER BY pp DESC LIMIT 125",
                 (userID, gameMode),
+                rowType=dbConnector.ROW_SCALAR,
             ),
         )
     )
@@ -590,13 +693,14 @@ def updateAccuracy(userID: int, gameMode: int, relax: bool) -> None:
     :return:
     """
 
-    newAcc = calculateAccuracy(userID, gameMode, relax)
+    newAcc = userTopScores.accuracy(userID, gameMode, relax)
     mode = gameModes.getGameModeForDB(gameMode)
 
     table = "rx_stats" if relax else "users_stats"
     glob.db.execute(
         f"UPDATE {table} SET avg_accuracy_{mode} = %s " "WHERE id = %s LIMIT 1",
         [newAcc, userID],
+        invalidates=(statsTag(userID),),
     )
 
 
@@ -613,13 +717,151 @@ def updatePP(userID: int, gameMode: int, relax: bool) -> None:
     # 	return
 
     # Get new total PP and update db
-    newPP = calculatePP(userID, gameMode, relax)
+    newPP = userTopScores.pp(userID, gameMode, relax)
     mode = gameModes.getGameModeForDB(gameMode)
 
     table = "rx_stats" if relax else "users_stats"
     glob.db.execute(
         f"UPDATE {table} SET pp_{mode} = %s " "WHERE id = %s LIMIT 1",
         [newPP, userID],
+        invalidates=(statsTag(userID),),
+    )
+
+
+def getTopPositions(userIDs: Any) -> Tuple[Any, Any]:
+    """
+    Split a sorted array of user ids in per-user runs.
+
+    :param userIDs: numpy array of user ids, grouped by user
+    :return: (index of the first row of each user, position of each row in its user's run)
+    """
+
+    import numpy as np
+
+    starts = np.flatnonzero(np.r_[True, userIDs[1:] != userIDs[:-1]])
+    lengths = np.diff(np.r_[starts, len(userIDs)])
+    positions = np.arange(len(userIDs)) - np.repeat(starts, lengths)
+    return starts, positions
+
+
+def calculateAllAccuracies(gameMode: int, relax: bool) -> Dict[int, float]:
+    """
+    Calculate the accuracy of every user for gameMode at once.
+    Same as calling calculateAccuracy for every user, for bulk jobs.
+
+    :param gameMode: game mode number
+    :param relax: whether to calculate relax or classic
+    :return: dictionary with user ids as keys and accuracies as values
+    """
+
+    import numpy as np
+
+    table = "scores_relax" if relax else "scores"
+    columns = glob.db.fetchColumns(
+        f"SELECT userid, accuracy FROM {table} "
+        "WHERE play_mode = %s AND completed = 3 "
+        "ORDER BY userid, pp DESC",
+        [gameMode],
+        dtypes={"userid": np.int64},
+    )
+    userIDs = columns["userid"]
+    if not len(userIDs):
+        return {}
+
+    # Weighted accuracy of the best 125 scores of each user
+    starts, positions = getTopPositions(userIDs)
+    weights = np.where(positions < 125, np.trunc((0.95**positions) * 100), 0)
+    totalAcc = np.add.reduceat(columns["accuracy"] * weights, starts)
+    divideTotal = np.add.reduceat(weights, starts)
+    accuracies = np.divide(
+        totalAcc,
+        divideTotal,
+        out=np.zeros_like(totalAcc),
+        where=divideTotal != 0,
+    )
+    return dict(zip(userIDs[starts].tolist(), accuracies.tolist()))
+
+
+def calculateAllPP(gameMode: int, relax: bool) -> Dict[int, int]:
+    """
+    Calculate the total PP of every user for gameMode at once.
+    Same as calling calculatePP for every user, for bulk jobs.
+
+    :param gameMode: game mode number
+    :param relax: whether to calculate for relax or classic
+    :return: dictionary with user ids as keys and total PP as values
+    """
+
+    import numpy as np
+
+    table = "scores_relax" if relax else "scores"
+    columns = glob.db.fetchColumns(
+        f"SELECT userid, pp FROM {table} LEFT JOIN(beatmaps) USING(beatmap_md5) "
+        "WHERE play_mode = %s AND completed = 3 "
+        "AND ranked >= 2 AND ranked != 5 AND pp IS NOT NULL ORDER BY userid, pp DESC",
+        [gameMode],
+        dtypes={"userid": np.int64},
+    )
+    userIDs = columns["userid"]
+    if not len(userIDs):
+        return {}
+
+    # Weighted pp of the best 125 scores of each user
+    starts, positions = getTopPositions(userIDs)
+    weighted = np.round(np.round(columns["pp"]) * 0.95**positions)
+    totals = np.add.reduceat(np.where(positions < 125, weighted, 0), starts)
+    return dict(zip(userIDs[starts].tolist(), totals.astype(np.int64).tolist()))
+
+
+def recalculateAllStats(gameMode: int, relax: bool) -> None:
+    """
+    Recalculate and save accuracy and PP of every user with scores in gameMode.
+
+    :param gameMode: game mode number
+    :param relax: whether to update relax or classic
+    :return:
+    """
+
+    accuracies = calculateAllAccuracies(gameMode, relax)
+    allPP = calculateAllPP(gameMode, relax)
+    mode = gameModes.getGameModeForDB(gameMode)
+
+    table = "rx_stats" if relax else "users_stats"
+    glob.db.executeMany(
+        f"UPDATE {table} SET avg_accuracy_{mode} = %s, pp_{mode} = %s "
+        "WHERE id = %s LIMIT 1",
+        [
+            (accuracy, allPP.get(userID, 0), userID)
+            for userID, accuracy in accuracies.items()
+        ],
+    )
+    # The cached best scores may be older than the ones the stats were computed from
+    userTopScores.invalidate(0)
+
+
+def recalculateAllLevels(gameMode: int, relax: bool) -> None:
+    """
+    Recalculate and save the level of every user in gameMode.
+
+    :param gameMode: game mode number
+    :param relax: whether to update relax or classic
+    :return:
+    """
+
+    import numpy as np
+
+    mode = gameModes.getGameModeForDB(gameMode)
+    table = "rx_stats" if relax else "users_stats"
+
+    columns = glob.db.fetchColumns(
+        f"SELECT id, total_score_{mode} AS total_score FROM {table}",
+        dtypes={"id": np.int64, "total_score": np.int64},
+    )
+    levels = getLevels(columns["total_score"])
+
+    glob.db.executeMany(
+        f"UPDATE {table} SET level_{mode} = %s WHERE id = %s LIMIT 1",
+        list(zip(levels.tolist(), columns["id"].tolist())),
     )
 
 
@@ -662,14 +904,15 @@ def updateStats(userID: int, __score, __old=None) -> None:
     table = "rx_stats" if relax else "users_stats"
 
     # Update total score and playcount
-    glob.db.execute(
-        "UPDATE {t} SET total_score_{m} = total_score_{m} + %s, "
-        "playcount_{m}=playcount_{m}+1 WHERE id = %s LIMIT 1".format(m=mode, t=table),
-        [__score.score, userID],
+    glob.db.counters.incrementMany(
+        table,
+        {"id": userID},
+        {f"total_score_{mode}": __score.score, f"playcount_{mode}": 1},
     )
+    glob.db.invalidate(statsTag(userID))
 
     # Calculate new level and update it
-    updateLevel(userID, __score.gameMode, relax)
+    updateLevel(userID, __score.gameMode, relax=relax)
 
     # Update level, accuracy and ranked score only if we have passed the song
     if __score.passed:
@@ -697,6 +940,15 @@ def updateStats(userID: int, __score, __old=None) -> None:
         glob.db.execute(
             qbase + " WHERE id = %s LIMIT 1",
             [__score.rankedScoreIncrease, userID],
+            invalidates=(statsTag(userID),),
+        )
+
+        # Add the score to the cached top scores, if it's a new best
+        userTopScores.addScore(
+            userID,
+            __score.gameMode,
+            relax,
+            getattr(__score, "scoreID", None),
         )
 
         # Update accuracy
@@ -714,10 +966,7 @@ def updateLatestActivity(userID: int) -> None:
     :return:
     """
 
-    glob.db.execute(
-        "UPDATE users " "SET latest_activity = UNIX_TIMESTAMP() " "WHERE id = %s",
-        [userID],
-    )
+    glob.db.counters.set("users", {"id": userID}, "latest_activity", int(time.time()))
 
 
 def getRankedScore(userID: int, gameMode: int) -> int:
@@ -729,13 +978,9 @@ def getRankedScore(userID: int, gameMode: int) -> int:
     :return: ranked score
     """
 
-    mode = gameModes.getGameModeForDB(gameMode)
-    result = glob.db.fetch(
-        f"SELECT ranked_score_{mode} " "FROM users_stats " "WHERE id = %s",
-        [userID],
-    )
+    snapshot = getStatsSnapshot(userID)
 
-    return result[f"ranked_score_{mode}"] if result else 0
+    return snapshot[gameMode].rankedScore if snapshot else 0
 
 
 def getPP(userID: int, gameMode: int, relax: bool, autopilot: bool) -> int:
@@ -747,20 +992,9 @@ def getPP(userID: int, gameMode: int, relax: bool, autopilot: bool) -> int:
     :return: pp
     """
 
-    mode = gameModes.getGameModeForDB(gameMode)
+    snapshot = getStatsSnapshot(userID, 2 if autopilot else 1 if relax else 0)
 
-    if autopilot:
-        stats_table = "ap_stats"
-    elif relax:
-        stats_table = "rx_stats"
-    else:
-        stats_table = "users_stats"
-
-    result = glob.db.fetch(
-        f"SELECT pp_{mode} FROM {stats_table} WHERE id = %s",
-        [userID],
-    )
-    return result[f"pp_{mode}"] if result else 0
+    return snapshot[gameMode].pp if snapshot else 0
 
 
 def incrementReplaysWatched(userID: int, gameMode: int, mods_used: int) -> None:
@@ -774,11 +1008,7 @@ def incrementReplaysWatched(userID: int, gameMode: int, mods_used: int) -> None:
 
     mode = gameModes.getGameModeForDB(gameMode)
     table = "rx_stats" if mods_used & mods.RELAX else "users_stats"
-    glob.db.execute(
-        f"UPDATE {table} SET replays_watched_{mode} = replays_watched_{mode} + 1 "
-        "WHERE id = %s",
-        [userID],
-    )
+    glob.db.counters.increment(table, {"id": userID}, f"replays_watched_{mode}")
 
 
 def IPLog(userID: int, ip: int) -> None:
@@ -790,10 +1020,11 @@ def IPLog(userID: int, ip: int) -> None:
     :return:
     """
 
-    glob.db.execute(
-        'INSERT INTO ip_user (userid, ip, occurencies) VALUES (%s, %s, "1") '
-        "ON DUPLICATE KEY UPDATE occurencies = occurencies + 1",
-        [userID, ip],
+    glob.db.counters.increment(
+        "ip_user",
+        {"userid": userID, "ip": ip},
+        "occurencies",
+        upsert=True,
     )
 
 
@@ -836,14 +1067,20 @@ def check2FA(userID: int, ip: int) -> bool:
     :return: True if untrusted, False if trusted or 2fa is disabled.
     """
 
-    if not is2FAEnabled(userID):
-        return False
-
-    return not glob.db.fetch(
-        "SELECT id FROM ip_user " "WHERE userid = %s AND ip = %s",
-        [userID, ip],
+    # Both lookups in a single round trip
+    enabled, trusted = glob.db.fetchMulti(
+        [
+            (
+                "SELECT 2fa_totp.userid FROM 2fa_totp "
+                "WHERE userid = %s AND enabled = 1",
+                [userID],
+            ),
+            ("SELECT id FROM ip_user " "WHERE userid = %s AND ip = %s", [userID, ip]),
+        ],
     )
 
+    return bool(enabled) and not trusted
+
 
 def isAllowed(userID: int) -> bool:
     """
@@ -937,6 +1174,7 @@ def ban(userID: int) -> None:
         "WHERE id = %s",
         [~(privileges.USER_NORMAL | privileges.USER_PUBLIC), userID],
     )
+    userRecords.invalidate(userID)
 
     # Notify bancho about the ban
     glob.redis.publish("peppy:ban", userID)
@@ -960,6 +1198,7 @@ def unban(userID: int) -> None:
         "WHERE id = %s",
         [privileges.USER_NORMAL | privileges.USER_PUBLIC, userID],
     )
+    userRecords.invalidate(userID)
 
     glob.redis.publish("peppy:unban", userID)
 
@@ -978,6 +1217,7 @@ def restrict(userID: int) -> None:
             "ban_datetime = UNIX_TIMESTAMP() WHERE id = %s",
             [~privileges.USER_PUBLIC, userID],
         )
+        userRecords.invalidate(userID)
 
         # Notify bancho about this ban
         glob.redis.publish("peppy:ban", userID)
@@ -1034,9 +1274,20 @@ def getPrivileges(userID: int) -> int:
     :return: privileges number
     """
 
-    result = glob.db.fetch("SELECT privileges " "FROM users " "WHERE id = %s", [userID])
+    result = userRecords.get(userID)
+
+    return result.privileges if result else 0
+
+
+def getPrivilegesMany(userIDs: List[int]) -> Dict[int, int]:
+    """
+    Return the privileges of many users
+
+    :param userIDs: list of user ids
+    :return: dictionary with user ids as keys and privileges (0 if the user doesn't exist) as values
+    """
 
-    return result["privileges"] if result else 0
+    return fetchByIDs("users", "privileges", userIDs, 0)
 
 
 def getFreezeTime(userID: int) -> int:
@@ -1047,9 +1298,9 @@ def getFreezeTime(userID: int) -> int:
     :return: timestamp
     """
 
-    result = glob.db.fetch("SELECT frozen " "FROM users " "WHERE id = %s", [userID])
+    result = userRecords.get(userID)
 
-    return result["frozen"] if result else 0
+    return result.frozen if result else 0
 
 
 def getFreezeReason(userID: int) -> Optional[str]:
@@ -1068,8 +1319,9 @@ def freeze(userID: int, author: int = 999) -> None:
 
     beginFreezeTimer(userID)  # to fix cron bugs
 
-    author_name = getUsername(author)
-    target_name = getUsername(userID)
+    names = getUsernames([author, userID])
+    author_name = names[author]
+    target_name = names[userID]
 
     appendNotes(userID, f"{author_name} ({author}) froze this user.")
     log.rap(author, f"froze {target_name} ({userID}).")
@@ -1086,6 +1338,7 @@ def beginFreezeTimer(userID) -> None:
         "UPDATE users SET frozen = %s " "WHERE id = %s",
         [restriction_time, userID],
     )
+    userRecords.invalidate(userID)
 
     return restriction_time  # Return so we can update the time
 
@@ -1102,10 +1355,12 @@ def unfreeze(userID: int, author: int = 999, _log=True) -> None:
         "UPDATE users " "SET frozen = 0, freeze_reason = '' WHERE id = %s",
         [userID],
     )
+    userRecords.invalidate(userID)
 
     if _log:
-        author_name = getUsername(author)
-        target_name = getUsername(userID)
+        names = getUsernames([author, userID])
+        author_name = names[author]
+        target_name = names[userID]
 
         appendNotes(userID, f"{author_name} ({author}) unfroze this user.")
         log.rap(author, f"unfroze {target_name} ({userID}).")
@@ -1124,9 +1379,7 @@ def getSilenceEnd(userID: int) -> int:
     :return: UNIX time
     """
 
-    return glob.db.fetch("SELECT silence_end " "FROM users " "WHERE id = %s", [userID])[
-        "silence_end"
-    ]
+    return userRecords.get(userID)["silence_end"]
 
 
 def silence(userID: int, seconds: int, silenceReason: str, author: int = 999) -> None:
@@ -1146,6 +1399,7 @@ def silence(userID: int, seconds: int, silenceReason: str, author: int = 999) ->
         "UPDATE users " "SET silence_end = %s, silence_reason = %s " "WHERE id = %s",
         [silence_time, silenceReason, userID],
     )
+    userRecords.invalidate(userID)
 
     log.rap(
         author,
@@ -1164,12 +1418,9 @@ def getTotalScore(userID: int, gameMode: int) -> int:
     :return: total score
     """
 
-    modeForDB = gameModes.getGameModeForDB(gameMode)
+    snapshot = getStatsSnapshot(userID)
 
-    return glob.db.fetch(
-        f"SELECT total_score_{modeForDB} " "FROM users_stats " "WHERE id = %s",
-        [userID],
-    )[f"total_score_{modeForDB}"]
+    return snapshot[gameMode].totalScore if snapshot else 0
 
 
 def getAccuracy(userID: int, gameMode: int) -> float:
@@ -1181,12 +1432,9 @@ def getAccuracy(userID: int, gameMode: int) -> float:
     :return: accuracy
     """
 
-    modeForDB = gameModes.getGameModeForDB(gameMode)
+    snapshot = getStatsSnapshot(userID)
 
-    return glob.db.fetch(
-        f"SELECT avg_accuracy_{modeForDB} " "FROM users_stats " "WHERE id = %s",
-        [userID],
-    )[f"avg_accuracy_{modeForDB}"]
+    return snapshot[gameMode].accuracy if snapshot else 0.0
 
 
 def getGameRank(userID: int, gameMode: int, relax_ap: int) -> int:
@@ -1221,12 +1469,9 @@ def getPlaycount(userID: int, gameMode: int) -> int:
     :return: playcount
     """
 
-    modeForDB = gameModes.getGameModeForDB(gameMode)
+    snapshot = getStatsSnapshot(userID)
 
-    return glob.db.fetch(
-        f"SELECT playcount_{modeForDB} " "FROM users_stats " "WHERE id = %s",
-        [userID],
-    )[f"playcount_{modeForDB}"]
+    return snapshot[gameMode].playcount if snapshot else 0
 
 
 def getFriendList(userID: int):
@@ -1238,21 +1483,18 @@ def getFriendList(userID: int):
     """
 
     # Get friends from db
-    # TODO: tuple cursor support? or use cmyui.mysql sync ver/make this native async
     friends = glob.db.fetchAll(
         "SELECT user2 " "FROM users_relationships " "WHERE user1 = %s",
         [userID],
+        rowType=dbConnector.ROW_SCALAR,
     )
 
-    if not friends or not len(friends):
+    if not friends:
         # We have no friends, return 0 list
         return [0]
-    else:
-        # Get only friends
-        friends = [i["user2"] for i in friends]
 
-        # Return friend IDs
-        return friends
+    # Return friend IDs
+    return friends
 
 
 def addFriend(userID: int, friendID: int) -> None:
@@ -1315,10 +1557,18 @@ def getCountry(userID: int) -> str:
     :return: country code (two letters)
     """
 
-    return glob.db.fetch(
-        "SELECT country " "FROM users_stats " "WHERE id = %s",
-        [userID],
-    )["country"]
+    return userRecords.get(userID)["country"]
+
+
+def getCountries(userIDs: List[int]) -> Dict[int, Optional[str]]:
+    """
+    Get the countries **(two letters)** of many users.
+
+    :param userIDs: list of user ids
+    :return: dictionary with user ids as keys and country codes (None if the user doesn't exist) as values
+    """
+
+    return fetchByIDs("users_stats", "country", userIDs)
 
 
 def setCountry(userID: int, country: str) -> None:
@@ -1334,6 +1584,7 @@ def setCountry(userID: int, country: str) -> None:
         "UPDATE users_stats " "SET country = %s " "WHERE id = %s",
         [country, userID],
     )
+    userRecords.invalidate(userID)
 
 
 def logIP(userID: int, ip: str) -> None:
@@ -1346,10 +1597,11 @@ def logIP(userID: int, ip: str) -> None:
     :return:
     """
 
-    glob.db.execute(
-        "INSERT INTO ip_user (userid, ip, occurencies) VALUES (%s, %s, 1) "
-        "ON DUPLICATE KEY UPDATE occurencies = occurencies + 1",
-        [userID, ip],
+    glob.db.counters.increment(
+        "ip_user",
+        {"userid": userID, "ip": ip},
+        "occurencies",
+        upsert=True,
     )
 
 
@@ -1391,6 +1643,7 @@ def setPrivileges(userID: int, priv: int) -> None:
         "UPDATE users " "SET privileges = %s " "WHERE id = %s",
         [priv, userID],
     )
+    userRecords.invalidate(userID)
 
 
 def getGroupPrivileges(groupName: str) -> Optional[int]:
@@ -1544,19 +1797,18 @@ def logHardware(userID: int, hashes: List[str], activation: bool = False) -> boo
                 },
             )
 
-        for i in banned:
-            # Get the total numbers of logins
+        # Get the total numbers of logins, the same for every match
+        total = None
+        if banned:
             total = glob.db.fetch(
                 "SELECT COUNT(*) AS count FROM hw_user WHERE userid = %s",
                 [userID],
             )
-            # and make sure it is valid
-            if not total:
-                continue
-            total = total["count"]
 
+        # and make sure it is valid
+        for i in banned if total else ():
             # Calculate 10% of total
-            if i["occurencies"] >= (total * 10) / 100:
+            if i["occurencies"] >= (total["count"] * 10) / 100:
                 # If the banned user has logged in more than 10% of the times from this user, restrict this user
                 restrict(userID)
                 appendNotes(
@@ -1598,17 +1850,19 @@ def resetPendingFlag(userID: int, success: bool = True) -> None:
     :param success: if True, set USER_PUBLIC and USER_NORMAL flags too
     """
 
-    glob.db.execute(
-        "UPDATE users " "SET privileges = privileges & %s " "WHERE id = %s",
-        [~privileges.USER_PENDING_VERIFICATION, userID],
-    )
-
-    if success:
-        glob.db.execute(
-            "UPDATE users " "SET privileges = privileges | %s " "WHERE id = %s",
-            [privileges.USER_PUBLIC | privileges.USER_NORMAL, userID],
+    with glob.db.transaction() as tx:
+        tx.execute(
+            "UPDATE users " "SET privileges = privileges & %s " "WHERE id = %s",
+            [~privileges.USER_PENDING_VERIFICATION, userID],
         )
 
+        if success:
+            tx.execute(
+                "UPDATE users " "SET privileges = privileges | %s " "WHERE id = %s",
+                [privileges.USER_PUBLIC | privileges.USER_NORMAL, userID],
+            )
+    userRecords.invalidate(userID)
+
 
 def verifyUser(userID: int, hashes: List[str]) -> bool:
     """
@@ -1716,9 +1970,9 @@ def getDonorExpire(userID: int) -> int:
     :return: donor expiration UNIX timestamp
     """
 
-    data = glob.db.fetch("SELECT donor_expire FROM users " "WHERE id = %s", [userID])
+    data = userRecords.get(userID)
 
-    return data["donor_expire"] if data else 0
+    return data.donor_expire if data else 0
 
 
 class invalidUsernameError(Exception):
@@ -1775,20 +2029,22 @@ def changeUsername(
         oldUsername: Optional[str] = getUsername(userID)
 
     # Change username
-    glob.db.execute(
-        "UPDATE users " "SET username = %s, username_safe = %s " "WHERE id = %s",
-        [newUsername, newUsernameSafe, userID],
-    )
+    with glob.db.transaction() as tx:
+        tx.execute(
+            "UPDATE users " "SET username = %s, username_safe = %s " "WHERE id = %s",
+            [newUsername, newUsernameSafe, userID],
+        )
 
-    glob.db.execute(
-        "UPDATE users_stats " "SET username = %s " "WHERE id = %s",
-        [newUsername, userID],
-    )
+        tx.execute(
+            "UPDATE users_stats " "SET username = %s " "WHERE id = %s",
+            [newUsername, userID],
+        )
 
-    glob.db.execute(
-        "UPDATE rx_stats " "SET username = %s " "WHERE id = %s",
-        [newUsername, userID],
-    )
+        tx.execute(
+            "UPDATE rx_stats " "SET username = %s " "WHERE id = %s",
+            [newUsername, userID],
+        )
+    userRecords.invalidate(userID)
 
     # Empty redis username cache
     # TODO: Le pipe woo woo
@@ -1893,13 +2149,8 @@ def getClan(userID: int) -> str:
 
 
 def getClanTag(userID: int) -> Optional[str]:
-    clan = glob.db.fetch(
-        "SELECT tag FROM clans "
-        "LEFT JOIN users ON clans.id = users.clan_id "
-        "WHERE users.id = %s",
-        [userID],
-    )
-    return clan["tag"] if clan else ""
+    user = userRecords.get(userID)
+    return user.clan_tag if user and user.clan_tag is not None else ""
 
 
 def getOverwriteWaitRemainder(userID: int) -> int:
@@ -1930,6 +2181,8 @@ def removeFirstPlaces(
     if game_mode is not None:
         q.append(f"AND mode = {game_mode}")
 
+    transfers = []
+    deletions = []
     for score in glob.db.fetchAll(" ".join(q), [userID]):
         if score["rx"]:
             table = "scores_relax"
@@ -1948,16 +2201,15 @@ def removeFirstPlaces(
         )
 
         if new:  # Transfer the #1 to the old #2.
-            glob.db.execute(
-                "UPDATE scores_first SET scoreid = %s, userid = %s "
-                "WHERE scoreid = %s",
-                [new["id"], new["userid"], score["scoreid"]],
-            )
+            transfers.append([new["id"], new["userid"], score["scoreid"]])
         else:  # There is no 2nd place, this was the only score.
-            glob.db.execute(
-                "DELETE FROM scores_first WHERE scoreid = %s",
-                [score["scoreid"]],
-            )
+            deletions.append([score["scoreid"]])
+
+    glob.db.executeMany(
+        "UPDATE scores_first SET scoreid = %s, userid = %s " "WHERE scoreid = %s",
+        transfers,
+    )
+    glob.db.executeMany("DELETE FROM scores_first WHERE scoreid = %s", deletions)
 
 
 def updateFirstPlaces(userID: int) -> None:
@@ -1967,6 +2219,7 @@ def updateFirstPlaces(userID: int) -> None:
     # If there is, overwrite that #1 with ours, otherwise
     # add the score to scores_first.
 
+    newFirsts = []
     for rx, table_name in enumerate(("scores", "scores_relax")):
         for score in glob.db.fetchAll(
             "SELECT s.id, s.pp, s.score, s.play_mode, "
@@ -1999,11 +2252,16 @@ def updateFirstPlaces(userID: int) -> None:
                 or score[order] > firstPlace[order]
                 or userID == firstPlace["userid"]
             ):
-                glob.db.execute(
-                    "REPLACE INTO scores_first " "VALUES (%s, %s, %s, %s, %s)",
+                newFirsts.append(
                     [score["beatmap_md5"], score["play_mode"], rx, score["id"], userID],
                 )
 
+    # Write all of the new #1s in a single multi-row statement.
+    glob.db.executeMany(
+        "REPLACE INTO scores_first " "VALUES (%s, %s, %s, %s, %s)",
+        newFirsts,
+    )
+
 
 def getProfile(userID: int) -> str:
     return f"https://akatsuki.pw/u/{userID}"
@@ -0,0 +1,177 @@
+"""
+userUtils hot paths benchmark.
+Runs without MySQL and redis: glob.db uses the SQLite backend (db.sqliteBackend)
+and glob.redis is a fakeRedis, so the results measure our own overhead
+(pool, caches, counters, query building) rather than the servers'.
+
+Usage: python -m common.ripple.userUtilsBenchmark [threads] [calls per thread] [users]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+from threading import Barrier
+from threading import Thread
+
+from common.constants import gameModes
+from common.db import dbConnector
+from common.db import sqliteBackend
+from common.ddog import datadogClient
+from common.redis.fakeRedis import fakeRedis
+from common.ripple import userUtils
+from objects import glob
+
+MODES = tuple(gameModes.getGameModeForDB(m) for m in range(4))
+STATS_COLUMNS = ", ".join(
+    f"{column}_{mode} {kind} NOT NULL DEFAULT 0"
+    for mode in MODES
+    for column, kind in (
+        ("ranked_score", "INT"),
+        ("avg_accuracy", "REAL"),
+        ("playcount", "INT"),
+        ("total_score", "INT"),
+        ("pp", "INT"),
+        ("replays_watched", "INT"),
+        ("playtime", "INT"),
+    )
+)
+SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT NOT NULL, "
+    "username_safe TEXT NOT NULL UNIQUE, privileges INT NOT NULL DEFAULT 3, "
+    "latest_activity INT NOT NULL DEFAULT 0, silence_end INT NOT NULL DEFAULT 0, "
+    "silence_reason TEXT NOT NULL DEFAULT '', frozen INT NOT NULL DEFAULT 0, "
+    "freeze_reason TEXT NOT NULL DEFAULT '', donor_expire INT NOT NULL DEFAULT 0, "
+    "clan_id INT NOT NULL DEFAULT 0)",
+    "CREATE TABLE clans (id INTEGER PRIMARY KEY, tag TEXT NOT NULL)",
+    "CREATE TABLE users_stats (id INTEGER PRIMARY KEY, "
+    f"country TEXT NOT NULL DEFAULT 'XX', {STATS_COLUMNS})",
+    f"CREATE TABLE rx_stats (id INTEGER PRIMARY KEY, {STATS_COLUMNS})",
+    "CREATE TABLE ip_user (id INTEGER PRIMARY KEY, userid INT NOT NULL, "
+    "ip TEXT NOT NULL, occurencies INT NOT NULL DEFAULT 0, UNIQUE (userid, ip))",
+    "CREATE TABLE `2fa_totp` (userid INTEGER PRIMARY KEY, enabled INT NOT NULL)",
+)
+
+
+def setup(users, path, poolSize=16, counterFlushInterval=None):
+    """
+    Point glob.db, glob.redis and glob.dog to local stand-ins and fill them with `users` users
+
+    :param users: number of users
+    :param path: SQLite database file
+    :param poolSize: glob.db pool size. Should be at least the number of threads
+    :param counterFlushInterval: glob.db counterFlushInterval option
+    :return:
+    """
+    glob.dog = datadogClient.datadogClient()
+    if not hasattr(glob, "DATADOG_PREFIX"):
+        glob.DATADOG_PREFIX = "benchmark"
+    glob.redis = fakeRedis()
+    glob.db = dbConnector.db(
+        "",
+        "",
+        "",
+        path,
+        initialSize=poolSize,
+        minSize=poolSize,
+        counterFlushInterval=counterFlushInterval,
+        backend=sqliteBackend,
+        initialConnections=None,
+    )
+    for query in SCHEMA:
+        glob.db.execute(query)
+
+    ids = range(1, users + 1)
+    glob.db.executeMany(
+        "INSERT INTO users (id, username, username_safe) VALUES (%s, %s, %s)",
+        [[i, f"User {i}", f"user_{i}"] for i in ids],
+    )
+    glob.db.executeMany(
+        "INSERT INTO users_stats (id, country, pp_std) VALUES (%s, %s, %s)",
+        [[i, "IT", i * 7 % 10000] for i in ids],
+    )
+    glob.db.executeMany("INSERT INTO rx_stats (id) VALUES (%s)", [[i] for i in ids])
+    glob.db.executeMany(
+        "INSERT INTO `2fa_totp` (userid, enabled) VALUES (%s, 1)",
+        [[i] for i in ids if i % 10 == 0],
+    )
+    glob.redis.zadd("ripple:leaderboard:std", {str(i): i * 7 % 10000 for i in ids})
+    for i in ids:
+        glob.redis.sadd(f"peppy:sessions:{i}", "127.0.0.1")
+
+
+# name -> function(userID)
+HOT_PATHS = {
+    "getUsername": userUtils.getUsername,
+    "getPrivileges": userUtils.getPrivileges,
+    "getCountry": userUtils.getCountry,
+    "getID": lambda userID: userUtils.getID(f"User {userID}"),
+    "getUserStats": lambda userID: userUtils.getUserStats(userID, gameModes.STD, 0),
+    "checkBanchoSession": lambda userID: userUtils.checkBanchoSession(
+        userID,
+        "127.0.0.1",
+    ),
+    "check2FA": lambda userID: userUtils.check2FA(userID, "127.0.0.1"),
+    "logIP": lambda userID: userUtils.logIP(userID, "127.0.0.1"),
+    "updateLatestActivity": userUtils.updateLatestActivity,
+}
+
+
+def run(function, threads=16, calls=1000, users=1000):
+    """
+    Call `function` `calls` times from each one of `threads` threads, with random-ish user IDs
+
+    :param function: function that takes a user ID
+    :param threads: number of threads
+    :param calls: number of calls made by each thread
+    :param users: number of users. IDs go from 1 to `users`
+    :return: (calls per second, p50 latency, p99 latency) tuple. Latencies are in microseconds.
+    """
+    barrier = Barrier(threads + 1)
+    latencies = []
+
+    def work(n):
+        local = []
+        barrier.wait()
+        for i in range(calls):
+            userID = (n * calls + i) * 7919 % users + 1
+            start = time.perf_counter()
+            function(userID)
+            local.append(time.perf_counter() - start)
+        latencies.extend(local)
+
+    workers = [Thread(target=work, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    start = time.perf_counter()
+    barrier.wait()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2] * 1e6,
+        latencies[len(latencies) * 99 // 100] * 1e6,
+    )
+
+
+def main(argv):
+    threads, calls, users = (int(x) for x in (argv + [16, 1000, 1000][len(argv) :]))
+    with tempfile.TemporaryDirectory() as directory:
+        setup(
+            users,
+            os.path.join(directory, "benchmark.db"),
+            poolSize=threads,
+            counterFlushInterval=1,
+        )
+        for name, function in HOT_PATHS.items():
+            rate, p50, p99 = run(function, threads, calls, users)
+            print(f"{name}: {rate:,.0f} calls/s, p50 {p50:,.1f}us, p99 {p99:,.1f}us")
+        glob.db.counters.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])